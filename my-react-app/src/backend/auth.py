@@ -10,9 +10,9 @@ auth.py - 用户认证管理模块
 6. 🚫 会话生命周期 - 登录状态维护和安全退出
 
 安全特性：
-- 数据库密码哈希：使用PBKDF2和盐值的密码加密
+- 数据库密码哈希：使用bcrypt（自带盐值）的密码加密
 - 安全会话令牌：使用secrets模块生成的URL安全令牌
-- 会话状态管理：内存中的活跃会话追踪
+- 会话状态管理：内存（或Redis）中的活跃会话追踪，空闲超时自动过期
 - 用户数据持久化：SQLite数据库存储用户信息
 
 设计模式：
@@ -21,7 +21,13 @@ auth.py - 用户认证管理模块
 - 会话管理：内存会话配合数据库用户管理
 """
 
+import asyncio
+import json
+import os
 import secrets
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, Optional
 from database import get_user_database, UserDatabase
 import logging
@@ -30,6 +36,164 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# ========================= 会话配置 =========================
+
+# 会话空闲超时时间（秒），超过该时间未访问的会话自动失效
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+
+# 最大活跃会话数，超出后淘汰最久未使用的会话，防止内存无限增长
+MAX_ACTIVE_SESSIONS = int(os.getenv("MAX_ACTIVE_SESSIONS", "100000"))
+
+# Redis 地址（可选），例如 redis://localhost:6379/0
+# 设置后会话保存在 Redis 中，多个工作进程共享登录状态，重启后会话不丢失；未设置时使用进程内存
+REDIS_URL = os.getenv("REDIS_URL")
+
+class SessionStore:
+    """
+    线程安全的会话存储 (LRU + TTL)
+    
+    以字典的方式使用，内部额外维护：
+    - 空闲过期：每次访问刷新过期时间，超时未访问的会话在下次访问时被清除
+    - 容量上限：超过maxsize时淘汰最久未使用的会话
+    - 互斥锁：登录校验在线程池中执行，所有读写都需要加锁
+    
+    数据结构: OrderedDict{session_token: (expires_at, session_info)}，按最近使用排序
+    """
+    
+    def __init__(self, maxsize: int = MAX_ACTIVE_SESSIONS, ttl: int = SESSION_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _purge_expired(self, now: float):
+        """清除所有已过期的会话（调用方需持有锁）"""
+        expired = [token for token, (expires_at, _) in self._data.items() if expires_at <= now]
+        for token in expired:
+            del self._data[token]
+    
+    def get(self, session_token: str, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(session_token)
+            if item is None:
+                return default
+            expires_at, session_info = item
+            if expires_at <= now:
+                del self._data[session_token]
+                return default
+            # 刷新过期时间并标记为最近使用
+            self._data[session_token] = (now + self.ttl, session_info)
+            self._data.move_to_end(session_token)
+            return session_info
+    
+    def __setitem__(self, session_token: str, session_info: Dict):
+        with self._lock:
+            self._data[session_token] = (time.monotonic() + self.ttl, session_info)
+            self._data.move_to_end(session_token)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def __getitem__(self, session_token: str) -> Dict:
+        session_info = self.get(session_token)
+        if session_info is None:
+            raise KeyError(session_token)
+        return session_info
+    
+    def __delitem__(self, session_token: str):
+        with self._lock:
+            del self._data[session_token]
+    
+    def __contains__(self, session_token: str) -> bool:
+        return self.get(session_token) is not None
+    
+    def pop(self, session_token: str, default=None):
+        with self._lock:
+            item = self._data.pop(session_token, None)
+        if item is None or item[0] <= time.monotonic():
+            return default
+        return item[1]
+    
+    def __len__(self) -> int:
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            return len(self._data)
+
+class RedisSessionStore:
+    """
+    基于 Redis 的会话存储，接口与 SessionStore 相同
+    
+    - 每个会话保存为一个键 session:{token}，值为JSON，使用 Redis 原生过期时间
+    - 每次访问刷新过期时间（滑动过期），与内存版行为一致
+    - 过期清理由 Redis 完成，无需容量上限
+    """
+    
+    KEY_PREFIX = "session:"
+    
+    def __init__(self, client, ttl: int = SESSION_TTL_SECONDS):
+        self._redis = client
+        self.ttl = ttl
+    
+    def _key(self, session_token: str) -> str:
+        return f"{self.KEY_PREFIX}{session_token}"
+    
+    def get(self, session_token: str, default=None):
+        key = self._key(session_token)
+        # 读取并刷新过期时间，一次往返完成
+        pipe = self._redis.pipeline()
+        pipe.get(key)
+        pipe.expire(key, self.ttl)
+        value, _ = pipe.execute()
+        if value is None:
+            return default
+        return json.loads(value)
+    
+    def __setitem__(self, session_token: str, session_info: Dict):
+        self._redis.set(self._key(session_token), json.dumps(session_info), ex=self.ttl)
+    
+    def __getitem__(self, session_token: str) -> Dict:
+        session_info = self.get(session_token)
+        if session_info is None:
+            raise KeyError(session_token)
+        return session_info
+    
+    def __delitem__(self, session_token: str):
+        if not self._redis.delete(self._key(session_token)):
+            raise KeyError(session_token)
+    
+    def __contains__(self, session_token: str) -> bool:
+        return self.get(session_token) is not None
+    
+    def pop(self, session_token: str, default=None):
+        key = self._key(session_token)
+        pipe = self._redis.pipeline()
+        pipe.get(key)
+        pipe.delete(key)
+        value, _ = pipe.execute()
+        if value is None:
+            return default
+        return json.loads(value)
+    
+    def __len__(self) -> int:
+        return sum(1 for _ in self._redis.scan_iter(match=f"{self.KEY_PREFIX}*", count=1000))
+
+def create_session_store():
+    """
+    创建会话存储
+    
+    设置了 REDIS_URL 且 Redis 可用时使用 RedisSessionStore，否则使用进程内存的 SessionStore
+    """
+    if REDIS_URL:
+        try:
+            import redis
+            client = redis.Redis.from_url(REDIS_URL)
+            client.ping()
+            logger.info("会话存储使用 Redis")
+            return RedisSessionStore(client)
+        except Exception as e:
+            logger.warning(f"Redis 不可用，会话存储改用进程内存: {e}")
+    return SessionStore()
+
 class AuthManager:
     """
     认证管理器 (数据库版本)
@@ -41,7 +205,7 @@ class AuthManager:
     - 与UserDatabase的集成管理
     
     安全设计：
-    - 使用数据库的PBKDF2+盐值进行密码哈希
+    - 使用数据库的bcrypt进行密码哈希
     - 会话令牌使用加密安全的随机数生成器
     - 数据持久化存储，重启后保持用户数据
     """
@@ -58,9 +222,9 @@ class AuthManager:
         # 获取数据库实例
         self.db: UserDatabase = get_user_database()
         
-        # 会话管理 - 存储已登录用户的会话令牌
+        # 会话管理 - 存储已登录用户的会话令牌（带过期时间和容量上限）
         # 数据结构: {session_token: user_info}
-        self.active_sessions: Dict[str, Dict] = {}
+        self.active_sessions = create_session_store()
         
         # 确保默认管理员账户存在
         self._ensure_admin_user()
@@ -68,9 +232,8 @@ class AuthManager:
     def _ensure_admin_user(self):
         """确保默认管理员账户存在"""
         try:
-            # 检查是否已存在管理员用户
-            result = self.db.authenticate_user("admin", "admin123")
-            if not result["success"]:
+            # 检查是否已存在管理员用户（只查询是否存在，不做密码校验）
+            if not self.db.user_exists("admin"):
                 # 创建默认管理员账户
                 result = self.db.create_user(
                     username="admin",
@@ -120,6 +283,23 @@ class AuthManager:
             logger.error(f"用户认证过程中出错: {str(e)}")
             return {"success": False, "message": "认证过程中发生错误"}
     
+    async def aauthenticate_user(self, username: str, password: str) -> Dict:
+        """
+        验证用户名和密码（异步版本）
+        
+        功能说明：
+        - 密码哈希校验是CPU密集型操作，直接在事件循环中执行会阻塞其他请求
+        - 将同步的authenticate_user放到线程池中执行，多个登录请求可并行处理
+        
+        Args:
+            username (str): 用户名或邮箱
+            password (str): 明文密码
+            
+        Returns:
+            Dict: 验证结果 {"success": bool, "message": str, "user": dict}
+        """
+        return await asyncio.to_thread(self.authenticate_user, username, password)
+    
     def register_user(self, username: str, password: str, email: str, **kwargs) -> Dict:
         """
         注册新用户
@@ -149,6 +329,24 @@ class AuthManager:
             logger.error(f"用户注册过程中出错: {str(e)}")
             return {"success": False, "message": "注册过程中发生错误"}
     
+    async def aregister_user(self, username: str, password: str, email: str, **kwargs) -> Dict:
+        """
+        注册新用户（异步版本）
+        
+        功能说明：
+        - 新密码的bcrypt哈希计算与登录校验同样耗时，放到线程池中执行，不阻塞事件循环
+        
+        Args:
+            username (str): 新用户名
+            password (str): 明文密码
+            email (str): 用户邮箱
+            **kwargs: 其他用户信息（如full_name, avatar_url）
+            
+        Returns:
+            Dict: 注册结果 {"success": bool, "message": str, "user_id": int}
+        """
+        return await asyncio.to_thread(self.register_user, username, password, email, **kwargs)
+    
     def create_session(self, user_info: Dict) -> str:
         """
         为登录用户生成安全的会话令牌
@@ -168,7 +366,7 @@ class AuthManager:
             session_token = secrets.token_urlsafe(32)
             self.active_sessions[session_token] = {
                 "user": user_info,
-                "created_at": secrets.token_hex(8)  # 简单的时间戳替代
+                "created_at": time.time()  # 创建时间戳，无需再读取一次系统随机数
             }
             logger.info(f"会话创建成功: 用户 {user_info.get('username', 'unknown')}")
             return session_token
@@ -209,12 +407,11 @@ class AuthManager:
         Returns:
             bool: 撤销成功返回True，令牌不存在返回False
         """
-        if session_token in self.active_sessions:
-            user = self.active_sessions[session_token]["user"]
-            del self.active_sessions[session_token]
-            logger.info(f"会话已撤销: 用户 {user.get('username', 'unknown')}")
-            return True
-        return False
+        session_info = self.active_sessions.pop(session_token, None)
+        if session_info is None:
+            return False
+        logger.info(f"会话已撤销: 用户 {session_info['user'].get('username', 'unknown')}")
+        return True
     
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """
@@ -255,17 +452,35 @@ class AuthManager:
         """
         return self.db.change_password(user_id, old_password, new_password)
     
-    def get_all_users(self, include_inactive: bool = False) -> list:
+    def get_all_users(self, include_inactive: bool = False, limit: Optional[int] = None,
+                      after: Optional[tuple] = None) -> list:
         """
-        获取所有用户列表（管理员功能）
+        获取用户列表（管理员功能）
         
         Args:
             include_inactive (bool): 是否包含已停用的用户
+            limit (int): 最多返回的用户数，None表示返回全部
+            after (tuple): 分页游标 (created_at, id)，只返回排在该用户之后的用户
             
         Returns:
             list: 用户列表
         """
-        return self.db.get_all_users(include_inactive)
+        return self.db.get_all_users(include_inactive, limit=limit, after=after)
+    
+    def get_users_page(self, limit: int = 100, after: Optional[tuple] = None,
+                       include_inactive: bool = False) -> Dict:
+        """
+        分页获取用户列表（管理员功能），每页只查询limit行
+        
+        Args:
+            limit (int): 每页用户数
+            after (tuple): 上一页返回的 next_cursor，获取第一页时为None
+            include_inactive (bool): 是否包含已停用的用户
+            
+        Returns:
+            Dict: {"users": list, "next_cursor": tuple或None}
+        """
+        return self.db.get_users_page(limit, after, include_inactive)
     
     def get_session_count(self) -> int:
         """获取当前活跃会话数量"""
@@ -277,5 +492,16 @@ class AuthManager:
         db_stats["active_sessions"] = self.get_session_count()
         return db_stats
 
-# 全局认证管理器实例
-auth_manager = AuthManager()
+# 全局认证管理器实例 - 延迟创建
+# 创建时会检查/初始化默认管理员账户，放到首次使用时执行，导入本模块几乎没有开销
+_auth_manager: Optional[AuthManager] = None
+_auth_manager_lock = threading.Lock()
+
+def get_auth_manager() -> AuthManager:
+    """获取全局认证管理器实例，首次调用时创建"""
+    global _auth_manager
+    if _auth_manager is None:
+        with _auth_manager_lock:
+            if _auth_manager is None:
+                _auth_manager = AuthManager()
+    return _auth_manager
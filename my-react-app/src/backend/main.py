@@ -18,15 +18,15 @@
 """
 
 import os
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Depends, UploadFile, File, Header
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-import json
+import orjson
 
 # 导入配置和模块
 from config import BASE_DIR, ENVIRONMENT, CORS_ORIGINS
@@ -34,23 +34,26 @@ from models import (
     ChatRequest, LoginRequest, RegisterRequest, 
     ChatResponse, UploadResponse, ErrorResponse, SuccessResponse
 )
-from auth import auth_manager
-from llm_chain import init_system, get_response, get_response_stream, clear_memory
+from auth import get_auth_manager
+from llm_chain import init_system, get_response, get_response_stream, clear_memory, invalidate_doc_qa_chain
 from document_processing import (
-    process_uploaded_file, split_documents, 
-    init_vector_store, clear_vector_store, clear_all_document_data, clear_user_document_data, clear_user_vector_store, generate_document_summary
+    process_uploaded_file, split_documents_to_texts, init_vector_store_from_texts,
+    clear_all_document_data, clear_user_vector_store, generate_text_summary
 )
-from config import UPLOAD_DIR, ALLOWED_EXTENSIONS
+from config import UPLOAD_DIR, ALLOWED_EXTENSIONS, LOG_LEVEL
 from pathlib import Path
 
 # 配置日志系统 - 统一的日志格式和级别
+# 级别由 LOG_LEVEL 环境变量控制（生产环境可设为 WARNING，低于该级别的日志不会格式化消息）；
+# 其他模块导入时已调用过 basicConfig，这里用 force=True 使统一的格式和级别生效
 logging.basicConfig(
-    level=logging.INFO,
+    level=getattr(logging, LOG_LEVEL.upper(), logging.INFO),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(),  # 控制台输出
         # 可以添加文件输出: logging.FileHandler('app.log')
-    ]
+    ],
+    force=True
 )
 logger = logging.getLogger(__name__)
 
@@ -155,7 +158,7 @@ async def lifespan(app: FastAPI):
     FastAPI应用生命周期管理函数。
     
     使用asynccontextmanager，此函数负责在应用启动和关闭时执行关键操作：
-    - 启动时: 调用app_state.initialize()来预加载和初始化所有必要的资源，
+    - 启动时: 在工作线程中调用app_state.initialize()来预加载和初始化所有必要的资源，
       如默认的LLM系统，确保应用准备就绪可以接收请求。
     - 关闭时: 执行清理操作，例如关闭数据库连接、释放资源等（当前仅记录日志）。
     
@@ -163,8 +166,9 @@ async def lifespan(app: FastAPI):
         app (FastAPI): FastAPI应用实例。
     """
     # 应用启动时执行
+    # LLM客户端的创建是同步阻塞操作，放到工作线程中执行，避免阻塞事件循环
     logger.info("应用启动中，开始初始化核心资源...")
-    app_state.initialize()
+    await asyncio.to_thread(app_state.initialize)
     
     yield
     
@@ -177,7 +181,8 @@ app = FastAPI(
     title="智能游戏对话系统",
     description="一个基于FastAPI和LangChain的多功能AI对话后端服务，提供游戏攻略、推荐、文档问答等多种功能。",
     version="1.0.1",
-    lifespan=lifespan  # 注册生命周期管理函数
+    lifespan=lifespan,  # 注册生命周期管理函数
+    default_response_class=ORJSONResponse  # 使用orjson序列化响应，比标准库json快数倍且直接输出UTF-8
 )
 
 
@@ -242,7 +247,7 @@ async def chat_endpoint(req: ChatRequest):
     1. 验证请求数据的有效性（如消息不能为空）。
     2. 从请求中提取用户ID、功能类型和聊天历史。
     3. 使用`get_llm_system`获取与功能匹配的LLM系统。
-    4. 调用`get_response`核心函数处理请求，生成回复。
+    4. 在工作线程中调用`get_response`核心函数处理请求，生成回复。
     5. 记录详细的调试日志，包括输入和输出。
     
     参数:
@@ -265,16 +270,20 @@ async def chat_endpoint(req: ChatRequest):
             )
         
         # 记录详细的请求信息用于调试
-        logger.info(f"=== 标准聊天请求 | 用户ID: {req.user_id} | 功能: {req.function} ===")
-        logger.info(f"消息: {req.message}")
-        logger.info(f"历史记录条数: {len(req.chat_history) if req.chat_history else 0}")
-        logger.info(f"游戏收藏条数: {len(req.game_collection) if req.game_collection else 0}")
+        logger.info("=== 标准聊天请求 | 用户ID: %s | 功能: %s ===", req.user_id, req.function)
+        logger.debug("消息: %s", req.message)
+        logger.debug("历史记录条数: %d", len(req.chat_history) if req.chat_history else 0)
+        logger.debug("游戏收藏条数: %d", len(req.game_collection) if req.game_collection else 0)
         
         # 获取功能特定的LLM系统
         system = get_llm_system(req.function)
         
         # 调用核心逻辑获取回复
-        response = get_response(req.message, system, req.function, req.user_id, req.chat_history, req.game_collection)
+        # get_response内部是同步阻塞的模型调用（通常耗时数秒），放到工作线程中执行，
+        # 避免阻塞事件循环导致其他请求（登录、流式对话等）排队等待
+        response = await asyncio.to_thread(
+            get_response, req.message, system, req.function, req.user_id, req.chat_history, req.game_collection
+        )
         
         return ChatResponse(response=response)
         
@@ -317,10 +326,10 @@ async def chat_stream_endpoint(req: ChatRequest):
                 content={"error": "消息不能为空"}
             )
         
-        logger.info(f"=== 流式聊天请求 | 用户ID: {req.user_id} | 功能: {req.function} ===")
-        logger.info(f"消息: {req.message}")
-        logger.info(f"历史记录条数: {len(req.chat_history) if req.chat_history else 0}")
-        logger.info(f"游戏收藏条数: {len(req.game_collection) if req.game_collection else 0}")
+        logger.info("=== 流式聊天请求 | 用户ID: %s | 功能: %s ===", req.user_id, req.function)
+        logger.debug("消息: %s", req.message)
+        logger.debug("历史记录条数: %d", len(req.chat_history) if req.chat_history else 0)
+        logger.debug("游戏收藏条数: %d", len(req.game_collection) if req.game_collection else 0)
         
         # 获取功能特定的LLM系统
         system = get_llm_system(req.function)
@@ -336,7 +345,7 @@ async def chat_stream_endpoint(req: ChatRequest):
                 # 迭代从核心逻辑获取的流式响应块
                 async for chunk in get_response_stream(req.message, system, req.function, req.user_id, req.chat_history, req.game_collection):
                     # 将每个块格式化为SSE `data` 字段
-                    yield f"data: {json.dumps({'content': chunk}, ensure_ascii=False)}\n\n"
+                    yield f"data: {orjson.dumps({'content': chunk}).decode()}\n\n"
                 
                 # 所有内容发送完毕后，发送结束标记
                 yield f"data: [DONE]\n\n"
@@ -344,7 +353,7 @@ async def chat_stream_endpoint(req: ChatRequest):
             except Exception as e:
                 logger.error(f"流式响应生成过程中出错: {str(e)}", exc_info=True)
                 # 在流中向客户端发送错误信息
-                yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+                yield f"data: {orjson.dumps({'error': str(e)}).decode()}\n\n"
         
         # 返回一个StreamingResponse，使用上面定义的生成器
         return StreamingResponse(
@@ -353,6 +362,7 @@ async def chat_stream_endpoint(req: ChatRequest):
             headers={
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
+                "X-Accel-Buffering": "no",  # 禁止Nginx等反向代理缓冲，保证数据块即时到达客户端
                 "Content-Type": "text/event-stream; charset=utf-8"
             }
         )
@@ -453,6 +463,11 @@ async def get_active_users():
 
 # === 测试端点 ===
 
+# 预先序列化的固定响应体 - 内容不随请求变化，启动时编码一次即可直接复用
+# 与其他端点（ORJSONResponse）一样用 orjson 序列化，输出字节格式保持一致
+_TEST_RESPONSE_BODY = orjson.dumps({"message": "后端服务正常运行", "status": "ok"})
+_ROOT_RESPONSE_BODY = orjson.dumps({"message": "智能游戏对话系统 API 服务正在运行"})
+
 @app.get("/test")
 async def test_endpoint():
     """
@@ -464,7 +479,7 @@ async def test_endpoint():
     返回:
         dict: 一个包含成功消息和状态的JSON对象。
     """
-    return {"message": "后端服务正常运行", "status": "ok"}
+    return Response(content=_TEST_RESPONSE_BODY, media_type="application/json")
 
 @app.get("/test/upload-config")
 async def test_upload_config():
@@ -564,31 +579,44 @@ async def upload_document(file: UploadFile = File(...), user_info: dict = Depend
             logger.info(f"用户 {user_info['user_id']} - 文件名: {file.filename}")
             logger.info(f"用户 {user_info['user_id']} - 文件扩展名: {file_extension}")
             
-            # 只清除该用户旧的向量数据，不清除上传文件
-            clear_user_vector_store(str(user_info['user_id']))
+            def build_user_vector_store():
+                # 向量库按内容哈希与旧文档比对，只删除旧文本块、写入新文本块，无需先清空
+                # 旧的文档问答链缓存了上一份文档的检索器，需要重新构建
+                invalidate_doc_qa_chain(str(user_info['user_id']))
+                
+                # 解析、分割并存储文档
+                documents = process_uploaded_file(file_path)
+                page_count = len(documents)
+                # 分割结果直接以文本和元数据写入向量库，不再为每个文本块创建Document对象
+                chunk_texts, chunk_metadatas = split_documents_to_texts(documents)
+                # 分割后不再需要整页文本，在耗时最长的嵌入阶段之前释放，降低内存峰值
+                del documents
+                init_vector_store_from_texts(chunk_texts, chunk_metadatas, str(user_info['user_id']))
+                # 处理期间的提问可能已缓存了"没有文档"的结果，写入完成后再失效一次
+                invalidate_doc_qa_chain(str(user_info['user_id']))
+                return page_count, chunk_texts
             
-            # 解析、分割并存储文档
-            documents = process_uploaded_file(file_path)
-            split_docs = split_documents(documents)
-            init_vector_store(split_docs, str(user_info['user_id']))
+            # 文档解析和嵌入计算耗时较长，放到线程池中执行，避免阻塞事件循环上的其他请求
+            page_count, chunk_texts = await asyncio.to_thread(build_user_vector_store)
             
             # 生成文档摘要
-            summary = generate_document_summary(split_docs)
+            summary = generate_text_summary(chunk_texts)
             
             logger.info(f"用户 {user_info['user_id']} - 文档处理成功。")
             return UploadResponse(
                 message="文件上传并处理成功",
                 filename=file.filename,
                 summary=summary,
-                page_count=len(documents),
-                chunk_count=len(split_docs)
+                page_count=page_count,
+                chunk_count=len(chunk_texts)
             )
             
         except Exception as e:
             logger.error(f"用户 {user_info['user_id']} - 文档处理失败: {str(e)}", exc_info=True)
-            # 清理失败时上传的文件
+            # 清理失败时上传的文件，以及可能只写入了一部分的向量数据
             if os.path.exists(file_path):
                 os.remove(file_path)
+            await asyncio.to_thread(clear_user_vector_store, str(user_info['user_id']))
             return JSONResponse(
                 status_code=500,
                 content={"error": f"文档处理失败: {str(e)}"}
@@ -616,6 +644,7 @@ async def clear_documents():
     """
     try:
         clear_all_document_data()
+        invalidate_doc_qa_chain()
         logger.info("所有文档数据和上传文件已清除。")
         return SuccessResponse(message="所有文档和上传文件已清除")
     except Exception as e:
@@ -669,12 +698,12 @@ async def login_endpoint(req: LoginRequest):
         - 失败: 401 Unauthorized错误响应。
     """
     try:
-        # 使用认证管理器验证凭据
-        auth_result = auth_manager.authenticate_user(req.username, req.password)
+        # 使用认证管理器验证凭据（密码校验在线程池中执行，避免阻塞事件循环）
+        auth_result = await get_auth_manager().aauthenticate_user(req.username, req.password)
         
         if auth_result["success"]:
             # 创建会话并获取令牌
-            session_token = auth_manager.create_session(auth_result["user"])
+            session_token = get_auth_manager().create_session(auth_result["user"])
             logger.info(f"用户 '{req.username}' 登录成功。")
             
             # 构建成功响应
@@ -723,7 +752,7 @@ async def register_endpoint(req: RegisterRequest):
         email = req.email if req.email else f"{req.username}@example.com"
         
         # 使用认证管理器注册新用户
-        register_result = auth_manager.register_user(
+        register_result = await get_auth_manager().aregister_user(
             username=req.username, 
             password=req.password,
             email=email
@@ -777,7 +806,7 @@ async def root():
     返回:
         dict: 包含欢迎消息的JSON对象。
     """
-    return {"message": "智能游戏对话系统 API 服务正在运行"}
+    return Response(content=_ROOT_RESPONSE_BODY, media_type="application/json")
 
 
 if __name__ == "__main__":
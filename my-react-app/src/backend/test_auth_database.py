@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试用户数据库和认证模块
+
+验证密码哈希升级、会话存储的过期与淘汰、用户列表分页等行为。
+所有测试使用临时目录中的数据库文件，不会改动仓库中的 user_database.db。
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+_TEST_DIR = None
+_ORIGINAL_CWD = None
+UserDatabase = None
+SessionStore = None
+RedisSessionStore = None
+
+
+def setup_module(module=None):
+    """切换到临时目录后再导入被测模块（database 模块导入时会在当前目录打开 user_database.db）"""
+    global _TEST_DIR, _ORIGINAL_CWD, UserDatabase, SessionStore, RedisSessionStore
+    _ORIGINAL_CWD = os.getcwd()
+    _TEST_DIR = tempfile.mkdtemp(prefix="auth_db_test_")
+    os.chdir(_TEST_DIR)
+    from database import UserDatabase as user_database_class
+    from auth import SessionStore as session_store_class, RedisSessionStore as redis_session_store_class
+    UserDatabase = user_database_class
+    SessionStore = session_store_class
+    RedisSessionStore = redis_session_store_class
+
+
+def teardown_module(module=None):
+    """恢复工作目录并删除临时目录"""
+    os.chdir(_ORIGINAL_CWD)
+    shutil.rmtree(_TEST_DIR, ignore_errors=True)
+
+
+def _new_database(name: str):
+    """在临时目录中创建一个全新的用户数据库"""
+    return UserDatabase(os.path.join(_TEST_DIR, f"{name}.db"))
+
+
+def test_legacy_password_upgrade():
+    """测试旧版 PBKDF2 哈希用户能够登录，登录后哈希升级为 bcrypt，错误密码被拒绝"""
+    db = _new_database("legacy")
+
+    # 按旧版方式直接写入 PBKDF2 哈希，模拟迁移前注册的用户
+    salt = "legacy-salt"
+    legacy_hash = db._hash_password_pbkdf2("old-password", salt)
+    with db._get_db_connection() as conn:
+        conn.execute(
+            "INSERT INTO users (username, email, password_hash, salt) VALUES (?, ?, ?, ?)",
+            ("legacy_user", "legacy@example.com", legacy_hash, salt)
+        )
+
+    # 错误密码不能登录，也不会触发升级
+    result = db.authenticate_user("legacy_user", "wrong-password")
+    assert not result["success"]
+    assert result["message"] == "密码错误"
+
+    # 正确密码可以登录
+    result = db.authenticate_user("legacy_user", "old-password")
+    assert result["success"], result
+    assert result["user"]["login_count"] == 1
+
+    # 登录后密码哈希已升级为 bcrypt，不再使用盐值字段
+    with db._get_db_connection() as conn:
+        stored_hash, stored_salt = conn.execute(
+            "SELECT password_hash, salt FROM users WHERE username = ?", ("legacy_user",)
+        ).fetchone()
+    import database
+    assert stored_hash.startswith(f"$2b${database.BCRYPT_ROUNDS:02d}$"), stored_hash
+    assert stored_salt == ""
+
+    # 升级后仍可用原密码登录，错误密码仍被拒绝
+    result = db.authenticate_user("legacy_user", "old-password")
+    assert result["success"], result
+    assert result["user"]["login_count"] == 2
+    assert not db.authenticate_user("legacy@example.com", "wrong-password")["success"]
+
+    print("✅ 旧版密码登录与升级测试通过")
+
+
+def test_users_page_with_same_created_at():
+    """测试用户分页游标在多个用户创建时间相同时不重复、不遗漏"""
+    db = _new_database("paging")
+
+    # 7个用户中有5个创建时间完全相同，另有1个已停用的用户
+    rows = [(f"user{i}", f"user{i}@example.com", "2024-01-01 00:00:00") for i in range(5)]
+    rows += [("early", "early@example.com", "2023-06-01 00:00:00"),
+             ("late", "late@example.com", "2024-03-01 00:00:00")]
+    with db._get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (username, email, password_hash, salt, created_at) VALUES (?, ?, 'x', '', ?)",
+            rows
+        )
+        conn.execute(
+            "INSERT INTO users (username, email, password_hash, salt, is_active, created_at) "
+            "VALUES ('inactive', 'inactive@example.com', 'x', '', FALSE, '2024-01-01 00:00:00')"
+        )
+
+    expected = db.get_all_users()
+    assert len(expected) == 7
+    # 排序为 (created_at, id) 倒序
+    keys = [(user["created_at"], user["id"]) for user in expected]
+    assert keys == sorted(keys, reverse=True)
+
+    # 每页2个用户翻页，游标落在相同创建时间的用户中间
+    paged = []
+    cursor = None
+    pages = 0
+    while True:
+        page = db.get_users_page(limit=2, after=cursor)
+        paged.extend(page["users"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+        assert pages < 10, "分页没有结束"
+    assert [user["id"] for user in paged] == [user["id"] for user in expected]
+    assert "inactive" not in {user["username"] for user in paged}
+
+    # 包含停用用户时同样完整
+    all_ids = []
+    cursor = None
+    while True:
+        page = db.get_users_page(limit=3, after=cursor, include_inactive=True)
+        all_ids.extend(user["id"] for user in page["users"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert sorted(all_ids) == list(range(1, 9))
+    assert len(set(all_ids)) == 8
+
+    print("✅ 用户分页测试通过")
+
+
+def test_session_ttl_expiry():
+    """测试会话空闲超时后失效，访问会刷新过期时间"""
+    store = SessionStore(maxsize=10, ttl=0.2)
+    store["active"] = {"user_id": 1}
+    store["idle"] = {"user_id": 2}
+
+    # 持续访问的会话不断续期，未访问的会话超时失效
+    for _ in range(3):
+        time.sleep(0.1)
+        assert store.get("active") == {"user_id": 1}
+    assert store.get("idle") is None
+    assert "idle" not in store
+    assert store.pop("idle") is None
+
+    time.sleep(0.25)
+    assert "active" not in store
+    assert len(store) == 0
+
+    print("✅ 会话过期测试通过")
+
+
+def test_session_lru_eviction():
+    """测试会话数超过上限时淘汰最久未使用的会话"""
+    store = SessionStore(maxsize=2, ttl=60)
+    store["a"] = {"user_id": 1}
+    store["b"] = {"user_id": 2}
+
+    # 访问a后b成为最久未使用的会话，写入c时被淘汰
+    assert store["a"] == {"user_id": 1}
+    store["c"] = {"user_id": 3}
+    assert "b" not in store
+    assert "a" in store and "c" in store
+    assert len(store) == 2
+
+    try:
+        store["b"]
+        raise AssertionError("已淘汰的会话不应能读取")
+    except KeyError:
+        pass
+
+    print("✅ 会话淘汰测试通过")
+
+
+def test_redis_session_store():
+    """测试 Redis 会话存储的读写与滑动过期（需要 fakeredis，未安装时跳过）"""
+    try:
+        import fakeredis
+    except ImportError:
+        message = "未安装 fakeredis，跳过 Redis 会话存储测试"
+        if "pytest" in sys.modules:
+            import pytest
+            pytest.skip(message)
+        print(f"⏭️ SKIP: {message}")
+        return
+
+    client = fakeredis.FakeRedis()
+    store = RedisSessionStore(client, ttl=60)
+    store["token"] = {"user_id": 1, "username": "redis_user"}
+
+    assert store.get("token") == {"user_id": 1, "username": "redis_user"}
+    assert 0 < client.ttl("session:token") <= 60
+    assert len(store) == 1
+
+    assert store.pop("token") == {"user_id": 1, "username": "redis_user"}
+    assert "token" not in store
+    assert store.pop("token", "missing") == "missing"
+
+    print("✅ Redis 会话存储测试通过")
+
+
+if __name__ == "__main__":
+    setup_module()
+    try:
+        test_legacy_password_upgrade()
+        test_users_page_with_same_created_at()
+        test_session_ttl_expiry()
+        test_session_lru_eviction()
+        test_redis_session_store()
+        print("\n✅ 所有测试完成！")
+    except Exception as e:
+        print(f"\n❌ 测试失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        teardown_module()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+测试对话链模块
+
+验证语义缓存不会写入文本块的持久化嵌入缓存，以及流式输出的合并与思考过程过滤。
+测试在临时目录中运行，向量库、嵌入缓存等运行时文件不会写入仓库目录。
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import asyncio
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BACKEND_DIR)
+
+_TEST_DIR = None
+_ORIGINAL_CWD = None
+llm_chain = None
+document_processing = None
+
+
+def setup_module(module=None):
+    """切换到临时目录后再导入被测模块（导入时会在当前目录创建 chroma_db 等目录）"""
+    global _TEST_DIR, _ORIGINAL_CWD, llm_chain, document_processing
+    _ORIGINAL_CWD = os.getcwd()
+    _TEST_DIR = tempfile.mkdtemp(prefix="llm_chain_test_")
+    os.chdir(_TEST_DIR)
+    import llm_chain as llm_chain_module
+    import document_processing as document_processing_module
+    llm_chain = llm_chain_module
+    document_processing = document_processing_module
+
+
+def teardown_module(module=None):
+    """恢复工作目录并删除临时目录"""
+    os.chdir(_ORIGINAL_CWD)
+    shutil.rmtree(_TEST_DIR, ignore_errors=True)
+
+
+class _FakeEmbeddings:
+    """记录调用次数的嵌入模型，不依赖 Ollama"""
+
+    def __init__(self):
+        self.query_calls = 0
+
+    def embed_query(self, text):
+        self.query_calls += 1
+        return [1.0, 0.5, 0.25]
+
+    def embed_documents(self, texts):
+        raise AssertionError("语义缓存不应批量计算文档嵌入")
+
+
+def _embedding_cache_rows() -> int:
+    conn = document_processing._connect_embedding_cache()
+    return conn.execute(f"SELECT COUNT(*) FROM {document_processing._EMBEDDING_CACHE_TABLE}").fetchone()[0]
+
+
+def test_semantic_cache_does_not_grow_embedding_cache():
+    """测试语义缓存的查询和写入不会向持久化嵌入缓存写入问题向量"""
+    # 使用临时目录中的嵌入缓存库
+    document_processing.EMBEDDING_CACHE_PATH = os.path.join(_TEST_DIR, "embedding_cache.db")
+    document_processing._embedding_cache_local.conn = None
+    rows_before = _embedding_cache_rows()
+
+    fake_embeddings = _FakeEmbeddings()
+    original_init_embeddings = llm_chain.init_embeddings
+    llm_chain.init_embeddings = lambda: fake_embeddings
+    try:
+        cache = llm_chain.SemanticCache(os.path.join(_TEST_DIR, "semantic_cache"), threshold=0.95, ttl=3600)
+        question = "推荐几款RPG游戏"
+        assert cache.lookup("general", question) is None
+        cache.store("general", question, "可以试试博德之门3")
+        assert cache.lookup("general", question) == "可以试试博德之门3"
+        # 其他功能下的同一问题不会命中
+        assert cache.lookup("play", question) is None
+    finally:
+        llm_chain.init_embeddings = original_init_embeddings
+
+    assert _embedding_cache_rows() == rows_before
+    # 同一问题的向量只计算一次
+    assert fake_embeddings.query_calls == 1
+
+    print("✅ 语义缓存不写入嵌入缓存测试通过")
+
+
+async def _chunks(*items, closed=None):
+    """按顺序产出文本块，数字表示在该位置等待的秒数；结束或被关闭时在closed中记录"""
+    try:
+        for item in items:
+            if isinstance(item, str):
+                yield item
+            else:
+                await asyncio.sleep(item)
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+async def _collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+def test_coalesce_stream_first_chunk_immediate():
+    """测试首个数据块不等待合并，立即输出"""
+    async def run():
+        stream = llm_chain._coalesce_stream(_chunks("你", 10, "好"), max_chars=100, max_delay=5)
+        try:
+            return await asyncio.wait_for(stream.__anext__(), timeout=0.5)
+        finally:
+            await stream.aclose()
+
+    assert asyncio.run(run()) == "你"
+
+    print("✅ 首个数据块立即输出测试通过")
+
+
+def test_coalesce_stream_flush_by_size():
+    """测试缓冲达到max_chars时立即合并输出，结束时输出剩余内容"""
+    chunks = _chunks("a", "bb", "cc", "d", "e")
+    result = asyncio.run(_collect(llm_chain._coalesce_stream(chunks, max_chars=4, max_delay=5)))
+    assert result == ["a", "bbcc", "de"], result
+
+    print("✅ 按字数合并输出测试通过")
+
+
+def test_coalesce_stream_flush_by_timeout():
+    """测试上游停顿超过max_delay时先输出已缓冲的内容，不丢失停顿后的数据块"""
+    chunks = _chunks("a", "b", "c", 0.3, "d", "e")
+    result = asyncio.run(_collect(llm_chain._coalesce_stream(chunks, max_chars=100, max_delay=0.05)))
+    assert result == ["a", "bc", "de"], result
+
+    print("✅ 按等待时间合并输出测试通过")
+
+
+def test_coalesce_stream_closes_upstream_on_early_exit():
+    """测试消费方提前结束时上游生成器被关闭，包括正在等待上游数据块的情况"""
+    async def break_between_reads():
+        closed = []
+        stream = llm_chain._coalesce_stream(_chunks("a", "b", closed=closed), max_chars=100, max_delay=5)
+        async for _ in stream:
+            break
+        await stream.aclose()
+        # 在事件循环结束前检查，asyncio.run退出时会自动关闭残留的异步生成器
+        return list(closed)
+
+    async def close_while_reading():
+        closed = []
+        stream = llm_chain._coalesce_stream(_chunks("a", "b", 10, "c", closed=closed), max_chars=100, max_delay=0.05)
+        # 第二个数据块超时输出后，上游正停在长时间等待中
+        assert await stream.__anext__() == "a"
+        assert await stream.__anext__() == "b"
+        await asyncio.wait_for(stream.aclose(), timeout=1)
+        return list(closed)
+
+    assert asyncio.run(break_between_reads()) == [True]
+    assert asyncio.run(close_while_reading()) == [True]
+
+    print("✅ 提前结束时关闭上游测试通过")
+
+
+def test_strip_reasoning_stream():
+    """测试跨数据块的思考过程被过滤，没有思考块时原样透传"""
+    chunks = _chunks("<th", "ink>先想一想</th", "ink>\n答案", "是42")
+    assert "".join(asyncio.run(_collect(llm_chain._strip_reasoning_stream(chunks)))) == "答案是42"
+
+    chunks = _chunks("直接", "回答")
+    assert asyncio.run(_collect(llm_chain._strip_reasoning_stream(chunks))) == ["直接", "回答"]
+
+    print("✅ 流式思考过程过滤测试通过")
+
+
+if __name__ == "__main__":
+    setup_module()
+    try:
+        test_semantic_cache_does_not_grow_embedding_cache()
+        test_coalesce_stream_first_chunk_immediate()
+        test_coalesce_stream_flush_by_size()
+        test_coalesce_stream_flush_by_timeout()
+        test_coalesce_stream_closes_upstream_on_early_exit()
+        test_strip_reasoning_stream()
+        print("\n✅ 所有测试完成！")
+    except Exception as e:
+        print(f"\n❌ 测试失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        teardown_module()